@@ -1,10 +1,52 @@
 import numpy as np
 from scipy import signal
+from numpy.lib.stride_tricks import sliding_window_view
 
-def stft_analysis(data, srate, freqs=None, window_size=0.5, overlap=0.5):
+def _stft_frames(block, nperseg, noverlap, window):
+    """
+    Windowed STFT frames, matching scipy.signal.stft defaults
+    (boundary='zeros', padded=True, detrend=False).
+
+    Parameters:
+    -----------
+    block : array, (n_trials, n_samples)
+
+    Returns:
+    --------
+    frames : array, (n_trials, n_times, nperseg)
+    """
+    nstep = nperseg - noverlap
+    # Zero-extend half a window on both sides
+    pad = nperseg // 2
+    n_ext = block.shape[-1] + 2 * pad
+    # Zero-pad the end so the last segment is complete
+    n_add = (-(n_ext - nperseg) % nstep) % nperseg
+
+    padded = np.zeros((block.shape[0], n_ext + n_add), dtype=block.dtype)
+    padded[:, pad:pad + block.shape[-1]] = block
+
+    frames = sliding_window_view(padded, nperseg, axis=-1)[:, ::nstep, :]
+    return frames * window
+
+def _dft_matrix(bins, nperseg, dtype=np.float64):
+    """
+    Real-valued DFT basis restricted to `bins`: (nperseg, 2 * n_bins),
+    cosine columns first, then (negated) sine columns.
+    """
+    n = np.arange(nperseg)[:, np.newaxis]
+    arg = 2 * np.pi * n * bins[np.newaxis, :] / nperseg
+    return np.hstack([np.cos(arg), -np.sin(arg)]).astype(dtype)
+
+def stft_analysis(data, srate, freqs=None, window_size=0.5, overlap=0.5,
+                  out=None, dtype=np.float64, chunk_size=None, method='auto'):
     """
     Perform Short-Time Fourier Transform.
 
+    All trials are transformed in one batched pass (optionally in blocks of
+    `chunk_size` trials). When `freqs` selects a narrow band, only the bins
+    inside it are computed with a pruned DFT (matrix product against the
+    selected DFT columns) instead of a full FFT per frame.
+
     Parameters:
     -----------
     data : array-like, (n_samples, n_trials)
@@ -13,6 +55,17 @@ def stft_analysis(data, srate, freqs=None, window_size=0.5, overlap=0.5):
         If provided, limits the output to this range.
     window_size : float (seconds)
     overlap : float (0-1)
+    out : array, (n_freqs, n_times, n_trials), optional
+        Pre-allocated output (e.g. a float32 array or np.memmap). Power is
+        written into it directly.
+    dtype : numpy dtype
+        dtype of the output when `out` is None (np.float32 halves memory).
+    chunk_size : int | None
+        Number of trials transformed at once. None processes all trials in
+        one block; smaller values bound the size of the complex intermediate.
+    method : 'auto' | 'fft' | 'dft'
+        'fft' computes the full spectrum and crops, 'dft' only computes the
+        bins inside `freqs`. 'auto' picks 'dft' when the band covers few bins.
 
     Returns:
     --------
@@ -20,30 +73,67 @@ def stft_analysis(data, srate, freqs=None, window_size=0.5, overlap=0.5):
     freq_axis : array
     time_axis : array
     """
+    data = np.asarray(data)
     n_samples, n_trials = data.shape
     nperseg = int(window_size * srate)
     noverlap = int(nperseg * overlap)
+    nstep = nperseg - noverlap
 
-    tf_list = []
-
-    # Process first trial to determine dimensions
-    f, t, Zxx = signal.stft(data[:, 0], fs=srate, nperseg=nperseg, noverlap=noverlap)
+    window = signal.get_window('hann', nperseg)
+    # scaling='spectrum', as in signal.stft
+    scale = 1.0 / window.sum()
 
+    f = np.fft.rfftfreq(nperseg, 1.0 / srate)
     if freqs is not None:
         freq_mask = (f >= freqs[0]) & (f <= freqs[1])
-        f = f[freq_mask]
     else:
         freq_mask = np.ones(len(f), dtype=bool)
+    bins = np.flatnonzero(freq_mask)
+    f = f[freq_mask]
+
+    # Segment centres, same convention as signal.stft
+    n_ext = n_samples + 2 * (nperseg // 2)
+    n_ext += (-(n_ext - nperseg) % nstep) % nperseg
+    t = np.arange(nperseg / 2, n_ext - nperseg / 2 + 1, nstep) / srate
+    t -= (nperseg / 2) / srate
 
     n_freqs = len(f)
     n_times = len(t)
 
-    tf_data = np.zeros((n_freqs, n_times, n_trials))
+    if out is None:
+        out = np.empty((n_freqs, n_times, n_trials), dtype=dtype)
+    elif out.shape != (n_freqs, n_times, n_trials):
+        raise ValueError(f"out has shape {out.shape}, expected {(n_freqs, n_times, n_trials)}")
+
+    if method == 'auto':
+        # A full FFT costs ~nperseg*log2(nperseg) per frame, the pruned DFT
+        # 2*n_freqs*nperseg but runs as a single BLAS product
+        method = 'dft' if n_freqs <= 2 * np.log2(max(nperseg, 2)) else 'fft'
+    if method not in ('fft', 'dft'):
+        raise ValueError(f"Unknown method: {method}")
+
+    if method == 'dft':
+        # Only float32 input keeps a float32 basis; integer input (e.g. int16
+        # EEG) is transformed in float64
+        basis_dtype = np.float32 if data.dtype == np.float32 else np.float64
+        basis = _dft_matrix(bins, nperseg, dtype=basis_dtype)
+        basis *= scale
+
+    if chunk_size is None:
+        chunk_size = n_trials
+
+    for start in range(0, n_trials, chunk_size):
+        stop = min(start + chunk_size, n_trials)
+        frames = _stft_frames(data[:, start:stop].T, nperseg, noverlap, window)
+
+        if method == 'dft':
+            proj = frames @ basis # (n_chunk, n_times, 2 * n_freqs)
+            p = proj[..., :n_freqs]**2 + proj[..., n_freqs:]**2
+        else:
+            spec = np.fft.rfft(frames, axis=-1)[..., bins] * scale
+            p = spec.real**2 + spec.imag**2
 
-    for i in range(n_trials):
-        f_trial, t_trial, Zxx_trial = signal.stft(data[:, i], fs=srate, nperseg=nperseg, noverlap=noverlap)
-        # Power
-        p = np.abs(Zxx_trial)**2
-        tf_data[:, :, i] = p[freq_mask, :]
+        # (n_chunk, n_times, n_freqs) -> (n_freqs, n_times, n_chunk)
+        out[:, :, start:stop] = p.transpose(2, 1, 0)
 
-    return tf_data, f, t
+    return out, f, t
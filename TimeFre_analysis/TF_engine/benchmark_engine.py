@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+# The per-method implementations live in the sibling directories
+_here = os.path.dirname(os.path.abspath(__file__))
+for _dir in ('Hilbert', 'STFT', 'Wavelet_transform'):
+    sys.path.insert(0, os.path.join(_here, '..', _dir))
+
+from time_frequency_engine import TimeFrequencyEngine
+from hilbert_analysis import hilbert_bands
+from stft_analysis import stft_analysis
+from wavelet_analysis import wavelet_analysis
+
+def create_dummy_data(n_epochs=100, n_channels=16, n_samples=1000, srate=250):
+    """Noisy 10 Hz oscillation, (n_epochs, n_channels, n_samples)."""
+    rng = np.random.RandomState(42)
+    times = np.arange(n_samples) / srate
+    data = np.sin(2 * np.pi * 10 * times) + rng.randn(n_epochs, n_channels, n_samples)
+    return data
+
+def run_separately(data, srate, bands, freqs, n_cycles, stft_freqs):
+    """The three existing functions, rearranged to the engine's layout."""
+    n_epochs, n_channels, n_samples = data.shape
+    hilbert_power, _ = hilbert_bands(data, srate, bands)
+    morlet_power = wavelet_analysis(data, srate, freqs, n_cycles=n_cycles)
+    # stft_analysis takes (n_samples, n_trials) and returns (n_freqs, n_times, n_trials)
+    stft_power, _, _ = stft_analysis(data.reshape(-1, n_samples).T, srate, freqs=stft_freqs)
+    stft_power = stft_power.transpose(2, 0, 1).reshape(n_epochs, n_channels, *stft_power.shape[:2])
+    return {'hilbert': hilbert_power.transpose(1, 2, 0, 3), 'morlet': morlet_power,
+            'stft': stft_power}
+
+def timeit(func, *args, repeats=3):
+    best = np.inf
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        out = func(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+def main():
+    srate = 250
+    bands = [[4, 8], [8, 13], [13, 30], [30, 45]]
+    freqs = np.linspace(4, 40, 10)
+    n_cycles = freqs / 2
+    stft_freqs = (1, 45)
+    data = create_dummy_data(n_epochs=100, n_channels=16, n_samples=1000, srate=srate)
+    n_samples = data.shape[-1]
+    print(f"Data: {data.shape[0]} epochs x {data.shape[1]} channels x {n_samples} samples")
+
+    t_sep, ref = timeit(run_separately, data, srate, bands, freqs, n_cycles, stft_freqs)
+
+    t0 = time.perf_counter()
+    engine = TimeFrequencyEngine(srate, n_samples, bands=bands, morlet_freqs=freqs,
+                                 n_cycles=n_cycles, stft_freqs=stft_freqs)
+    t_setup = time.perf_counter() - t0
+    t_engine, out = timeit(lambda: engine.transform(data, block_size=10))
+
+    print(f"Separate (hilbert_bands + wavelet_analysis + stft_analysis): {t_sep:.3f} s")
+    print(f"TimeFrequencyEngine (nfft={engine.nfft}, setup {t_setup:.3f} s): {t_engine:.3f} s")
+    print(f"Speedup : {t_sep / t_engine:.1f}x")
+
+    for key in ('morlet', 'stft'):
+        rel_err = np.max(np.abs(out[key] - ref[key])) / np.max(ref[key])
+        print(f"Max relative {key} power difference: {rel_err:.2e}")
+    # The Hilbert envelopes differ near the edges (zero padding instead of
+    # sosfiltfilt's odd extension), compare the centre
+    centre = slice(n_samples // 4, n_samples - n_samples // 4)
+    rel_err = (np.max(np.abs(out['hilbert'][..., centre] - ref['hilbert'][..., centre]))
+               / np.max(ref['hilbert']))
+    print(f"Max relative hilbert power difference (centre): {rel_err:.2e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import numpy as np
+from scipy import signal
+from scipy import fft as sp_fft
+import mne
+
+def _zero_phase_length(sos, srate, low, tol=1e-3):
+    """
+    Samples until the impulse response of the zero-phase (forward-backward)
+    filter decays below `tol` times its peak, on each side.
+    """
+    # Long enough for ~50 periods of the lower band edge
+    n = sp_fft.next_fast_len(int(100 * srate / low))
+    _, h = signal.sosfreqz(sos, worN=n // 2 + 1, fs=srate)
+    response = np.abs(np.fft.irfft(np.abs(h)**2, n)[:n // 2])
+    return int(np.flatnonzero(response > tol * response.max())[-1]) + 1
+
+class TimeFrequencyEngine:
+    """
+    Hilbert, Morlet and STFT outputs from one shared FFT per trial block.
+
+    Every output is a linear filter of the signal, so all of them are
+    computed from the same zero-padded spectrum: the signal FFT is taken
+    once, multiplied with one precomputed kernel spectrum per band/frequency
+    and transformed back.
+
+    - Hilbert: zero-phase Butterworth band-pass applied in the frequency
+      domain (|H(f)|^2, the response of sosfiltfilt) with the negative
+      frequencies removed, which gives the analytic signal directly. This is
+      forward-backward filtering of the zero-padded epoch; hilbert_analysis
+      pads with an odd extension and takes a circular Hilbert transform, so
+      the envelopes differ near the epoch edges (within the filter's impulse
+      response length).
+    - Morlet: the wavelets of `mne.time_frequency.morlet`, as in
+      wavelet_analysis (identical results).
+    - STFT: each frequency bin is a correlation with the modulated window,
+      sampled at the frame positions of scipy.signal.stft (boundary='zeros',
+      padded=True), as in stft_analysis (identical results). Only every
+      hop-th sample is needed, so the spectrum is folded and a short inverse
+      FFT per bin suffices.
+
+    All outputs use the (n_epochs, n_channels, n_freqs, n_times) layout; for
+    the STFT n_times is the number of frames.
+
+    Parameters:
+    -----------
+    srate : float
+        Sampling rate.
+    n_times : int
+        Number of samples per epoch.
+    bands : list of (low, high) | None
+        Hilbert frequency bands in Hz.
+    morlet_freqs : array-like | None
+        Morlet wavelet frequencies.
+    n_cycles : float or array-like
+        Cycles of the Morlet wavelets.
+    stft_window : float
+        STFT window length in seconds (Hann window).
+    stft_overlap : float
+        STFT window overlap (0-1).
+    stft_freqs : (min_freq, max_freq) | None
+        STFT frequency range; None keeps all bins. The STFT is only computed
+        when `stft_freqs` is given or `stft=True`.
+    stft : bool
+        Compute the STFT for all bins when stft_freqs is None.
+    filter_order : int
+        Butterworth order of the Hilbert band-pass filters.
+    zero_mean : bool
+        Zero-mean Morlet wavelets (default True, as in wavelet_analysis).
+    """
+
+    def __init__(self, srate, n_times, bands=None, morlet_freqs=None, n_cycles=7.0,
+                 stft_window=0.5, stft_overlap=0.5, stft_freqs=None, stft=False, filter_order=4,
+                 zero_mean=True):
+        self.srate = float(srate)
+        self.n_times = int(n_times)
+        self.bands = [tuple(band) for band in bands] if bands is not None else []
+        self.morlet_freqs = np.asarray(morlet_freqs, dtype=float) if morlet_freqs is not None else np.zeros(0)
+        self.do_stft = stft or stft_freqs is not None
+
+        # Padding needed for linear (not circular) filtering by every kernel
+        pad = 0
+        nyquist = self.srate / 2.0
+        sos_bands = [signal.butter(filter_order, [low / nyquist, high / nyquist], btype='bandpass',
+                                   output='sos') for low, high in self.bands]
+        for (low, _), sos in zip(self.bands, sos_bands):
+            # Let the band-pass impulse responses decay
+            pad = max(pad, _zero_phase_length(sos, self.srate, low))
+        if len(self.morlet_freqs):
+            if (self.morlet_freqs > self.srate / 2.0).any():
+                raise ValueError(f"Cannot compute freq above Nyquist freq of the data "
+                                 f"({self.srate / 2.0:0.1f} Hz), got {self.morlet_freqs.max():0.1f} Hz")
+            wavelets = mne.time_frequency.morlet(self.srate, self.morlet_freqs, n_cycles=n_cycles,
+                                                 zero_mean=zero_mean)
+            sizes = np.array([w.size for w in wavelets])
+            if sizes.max() > self.n_times:
+                raise ValueError(f"At least one of the wavelets is longer than the signal "
+                                 f"({sizes.max()} > {self.n_times} samples).")
+            pad = max(pad, int(sizes.max()) - 1)
+        if self.do_stft:
+            self.nperseg = int(stft_window * self.srate)
+            noverlap = int(self.nperseg * stft_overlap)
+            self.nstep = self.nperseg - noverlap
+            pad = max(pad, 2 * self.nperseg)
+            # A multiple of the hop, so the STFT frames can be read off a folded
+            # spectrum (see transform)
+            self.nfft = self.nstep * sp_fft.next_fast_len(-(-(self.n_times + pad) // self.nstep))
+        else:
+            self.nfft = sp_fft.next_fast_len(self.n_times + pad)
+        fft_freqs = sp_fft.fftfreq(self.nfft, 1.0 / self.srate)
+
+        # Hilbert: |H|^2 on positive frequencies, doubled (analytic signal).
+        # Only the non-negative half is stored, the rest of the kernel is zero
+        positive = np.flatnonzero(fft_freqs >= 0)
+        self._hilbert_kernels = np.zeros((len(self.bands), len(positive)))
+        analytic_gain = np.where(fft_freqs[positive] > 0, 2.0, 1.0)
+        if self.nfft % 2 == 0:
+            analytic_gain[-1] = 1.0 # Nyquist
+        for i, sos in enumerate(sos_bands):
+            _, h = signal.sosfreqz(sos, worN=fft_freqs[positive], fs=self.srate)
+            self._hilbert_kernels[i] = np.abs(h)**2 * analytic_gain
+
+        # Morlet: wavelet spectra, 'same' part of the convolution is centred
+        self._morlet_kernels = np.empty((len(self.morlet_freqs), self.nfft), dtype=np.complex128)
+        self._morlet_starts = np.zeros(len(self.morlet_freqs), dtype=int)
+        if len(self.morlet_freqs):
+            self._morlet_starts = (sizes - 1) // 2
+            for i, w in enumerate(wavelets):
+                self._morlet_kernels[i] = sp_fft.fft(w, self.nfft)
+
+        # STFT: y_k[t] = sum_m x[t + m] w[m] exp(-2j pi k m / nperseg) / sum(w),
+        # a correlation, i.e. the conjugate spectrum of the conjugated kernel
+        self.stft_freqs = np.zeros(0)
+        self.stft_times = np.zeros(0)
+        self._stft_kernels = np.empty(0, dtype=np.complex128)
+        if self.do_stft:
+            window = signal.get_window('hann', self.nperseg)
+            f = np.fft.rfftfreq(self.nperseg, 1.0 / self.srate)
+            if stft_freqs is not None:
+                bins = np.flatnonzero((f >= stft_freqs[0]) & (f <= stft_freqs[1]))
+            else:
+                bins = np.arange(len(f))
+            self.stft_freqs = f[bins]
+
+            m = np.arange(self.nperseg)
+            g = window * np.exp(-2j * np.pi * np.outer(bins, m) / self.nperseg) / window.sum()
+            kernels = np.conj(sp_fft.fft(np.conj(g), self.nfft, axis=-1))
+
+            # Frame j starts at j * nstep - nperseg // 2, as in signal.stft (half
+            # a window of zeros in front, the wrap-around reads the zero padding).
+            # Shift the kernels by that offset, so frame j is sample j * nstep.
+            k = np.arange(self.nfft)
+            kernels *= np.exp(-2j * np.pi * k * (self.nperseg // 2) / self.nfft)
+            # Sampling every nstep-th output sample folds the spectrum onto
+            # nfft / nstep bins; 1 / nstep is the ifft normalization. Stored as
+            # (n_fold, nstep, n_bins) so the fold of all bins is one matmul.
+            kernels /= self.nstep
+            self._stft_kernels = kernels.reshape(len(bins), self.nstep, -1).transpose(2, 1, 0).copy()
+
+            n_ext = self.n_times + 2 * (self.nperseg // 2)
+            n_ext += (-(n_ext - self.nperseg) % self.nstep) % self.nperseg
+            self._n_frames = (n_ext - self.nperseg) // self.nstep + 1
+            self.stft_times = np.arange(self._n_frames) * self.nstep / self.srate
+
+    @property
+    def nbytes(self):
+        """Memory held by the kernel spectra."""
+        return (self._hilbert_kernels.nbytes + self._morlet_kernels.nbytes
+                + self._stft_kernels.nbytes)
+
+    def transform(self, data, outputs=None, output='power',
+                  block_size=None, dtype=None, workers=None):
+        """
+        Compute the requested outputs with one FFT per block of epochs.
+
+        Parameters:
+        -----------
+        data : array, (n_epochs, n_channels, n_times) or (n_epochs, n_times)
+        outputs : tuple of 'hilbert' | 'morlet' | 'stft' | None
+            None computes every output the engine was built for.
+        output : 'power' | 'complex'
+            Power (|z|^2), or the complex analytic signal / wavelet coefficients
+            / STFT (phase via np.angle).
+        block_size : int | None
+            Number of epochs transformed at once (bounds the size of the
+            complex spectrum); None processes all epochs together.
+        dtype : numpy dtype | None
+            Output dtype (default float64 for power, complex128 otherwise).
+        workers : int | None
+            Passed to scipy.fft for multi-threaded FFTs.
+
+        Returns:
+        --------
+        result : dict
+            'hilbert' : (n_epochs, n_channels, n_bands, n_times)
+            'morlet' : (n_epochs, n_channels, n_freqs, n_times)
+            'stft' : (n_epochs, n_channels, n_stft_freqs, n_frames)
+        """
+        data = np.asarray(data)
+        if data.ndim == 2:
+            # (n_epochs, n_times): one channel
+            data = data[:, np.newaxis, :]
+        if data.shape[-1] != self.n_times:
+            raise ValueError(f"Engine built for {self.n_times} samples, got {data.shape[-1]}")
+        if output not in ('power', 'complex'):
+            raise ValueError(f"Unknown output: {output}")
+        if dtype is None:
+            dtype = np.float64 if output == 'power' else np.complex128
+        if outputs is None:
+            outputs = [name for name, n in (('hilbert', len(self.bands)),
+                                            ('morlet', len(self.morlet_freqs)),
+                                            ('stft', self.do_stft)) if n]
+
+        n_epochs = data.shape[0]
+        lead = data.shape[:2]
+        result = {}
+        if 'hilbert' in outputs:
+            result['hilbert'] = np.empty(lead + (len(self.bands), self.n_times), dtype=dtype)
+        if 'morlet' in outputs:
+            result['morlet'] = np.empty(lead + (len(self.morlet_freqs), self.n_times), dtype=dtype)
+        if 'stft' in outputs:
+            if not self.do_stft:
+                raise ValueError("Engine was built without STFT (pass stft_freqs or stft=True)")
+            result['stft'] = np.empty(lead + (len(self.stft_freqs), len(self.stft_times)),
+                                      dtype=dtype)
+
+        def store(out, idx, values):
+            if output == 'power':
+                out[idx] = values.real**2 + values.imag**2
+            else:
+                out[idx] = values
+
+        if block_size is None:
+            block_size = n_epochs
+        for e0 in range(0, n_epochs, block_size):
+            e1 = min(e0 + block_size, n_epochs)
+            # The one FFT shared by all outputs
+            spec = sp_fft.fft(data[e0:e1], self.nfft, axis=-1, workers=workers)
+
+            if 'hilbert' in result:
+                n_pos = self._hilbert_kernels.shape[1]
+                analytic_spec = np.zeros_like(spec)
+                for i, kernel in enumerate(self._hilbert_kernels):
+                    np.multiply(spec[..., :n_pos], kernel, out=analytic_spec[..., :n_pos])
+                    z = sp_fft.ifft(analytic_spec, axis=-1, workers=workers)[..., :self.n_times]
+                    store(result['hilbert'], (slice(e0, e1), slice(None), i), z)
+
+            if 'morlet' in result:
+                for i, (kernel, start) in enumerate(zip(self._morlet_kernels, self._morlet_starts)):
+                    z = sp_fft.ifft(spec * kernel, axis=-1, workers=workers)[..., start:start + self.n_times]
+                    store(result['morlet'], (slice(e0, e1), slice(None), i), z)
+
+            if 'stft' in result:
+                # ifft(Y)[::nstep] == ifft(sum of the nstep length-n_fold pieces
+                # of Y), for all bins at once: (n_fold, rows, nstep) @ (n_fold, nstep, n_bins)
+                n_fold = self.nfft // self.nstep
+                pieces = spec.reshape(-1, self.nstep, n_fold).transpose(2, 0, 1)
+                folded = np.matmul(pieces, self._stft_kernels) # (n_fold, rows, n_bins)
+                z = sp_fft.ifft(folded, axis=0, workers=workers)[:self._n_frames]
+                # (n_frames, rows, n_bins) -> (epochs, channels, n_bins, n_frames)
+                z = z.transpose(1, 2, 0).reshape(spec.shape[:2] + z.shape[2:] + z.shape[:1])
+                store(result['stft'], (slice(e0, e1),), z)
+
+        return result
@@ -1,7 +1,147 @@
+from collections import OrderedDict
+
 import numpy as np
 from scipy import signal
+from scipy import fft as sp_fft
 import mne
 
+class MorletBank:
+    """
+    Precomputed Morlet kernel spectra for a fixed (freqs, srate, n_cycles, n_times).
+
+    The wavelets are the same as `mne.time_frequency.morlet`, and `transform`
+    reproduces `tfr_array_morlet(..., use_fft=True)`: the signal FFT is
+    computed once per call and multiplied with every kernel spectrum. Since
+    the FFT length is fixed per bank, scipy.fft reuses its cached plans across
+    calls.
+
+    Parameters:
+    -----------
+    freqs : array-like
+        Frequencies of interest.
+    srate : float
+        Sampling rate.
+    n_cycles : float or array-like
+        Number of cycles, fixed or one per frequency.
+    n_times : int
+        Length of the signals this bank is applied to.
+    zero_mean : bool
+        Zero-mean wavelets (default True, as in tfr_array_morlet).
+    """
+
+    def __init__(self, freqs, srate, n_cycles, n_times, zero_mean=True):
+        self.freqs = np.asarray(freqs, dtype=float)
+        self.srate = float(srate)
+        self.n_cycles = n_cycles
+        self.n_times = int(n_times)
+
+        if (self.freqs > self.srate / 2.0).any():
+            raise ValueError(f"Cannot compute freq above Nyquist freq of the data "
+                             f"({self.srate / 2.0:0.1f} Hz), got {self.freqs.max():0.1f} Hz")
+
+        wavelets = mne.time_frequency.morlet(self.srate, self.freqs, n_cycles=n_cycles,
+                                             zero_mean=zero_mean)
+        sizes = np.array([w.size for w in wavelets])
+        if sizes.max() > self.n_times:
+            raise ValueError(f"At least one of the wavelets is longer than the signal "
+                             f"({sizes.max()} > {self.n_times} samples).")
+
+        # Linear (not circular) convolution, 'same' part is centred
+        self.nfft = sp_fft.next_fast_len(self.n_times + int(sizes.max()) - 1)
+        self.starts = (sizes - 1) // 2
+
+        self.kernels = np.empty((len(self.freqs), self.nfft), dtype=np.complex128)
+        for i, w in enumerate(wavelets):
+            self.kernels[i] = sp_fft.fft(w, self.nfft)
+
+    @property
+    def nbytes(self):
+        return self.kernels.nbytes
+
+    def transform(self, data, output='power', workers=None):
+        """
+        Convolve data with every wavelet.
+
+        Parameters:
+        -----------
+        data : array, (..., n_times)
+        output : 'power' | 'complex'
+        workers : int | None
+            Passed to scipy.fft for multi-threaded FFTs.
+
+        Returns:
+        --------
+        out : array, (..., n_freqs, n_times)
+        """
+        data = np.asarray(data)
+        if data.shape[-1] != self.n_times:
+            raise ValueError(f"Bank built for {self.n_times} samples, got {data.shape[-1]}")
+
+        spec = sp_fft.fft(data, self.nfft, axis=-1, workers=workers)
+
+        dtype = np.float64 if output == 'power' else np.complex128
+        out = np.empty(data.shape[:-1] + (len(self.freqs), self.n_times), dtype=dtype)
+
+        for i, start in enumerate(self.starts):
+            conv = sp_fft.ifft(spec * self.kernels[i], axis=-1, workers=workers)
+            conv = conv[..., start:start + self.n_times]
+            if output == 'power':
+                out[..., i, :] = conv.real**2 + conv.imag**2
+            else:
+                out[..., i, :] = conv
+
+        return out
+
+class MorletBankCache:
+    """
+    LRU cache of MorletBank objects, evicted by total kernel memory.
+
+    Parameters:
+    -----------
+    max_bytes : int
+        Upper bound on the summed size of the cached kernel spectra.
+    """
+
+    def __init__(self, max_bytes=256 * 1024**2):
+        self.max_bytes = max_bytes
+        self._banks = OrderedDict()
+
+    @property
+    def nbytes(self):
+        return sum(bank.nbytes for bank in self._banks.values())
+
+    def __len__(self):
+        return len(self._banks)
+
+    def clear(self):
+        self._banks.clear()
+
+    def get(self, freqs, srate, n_cycles, n_times, zero_mean=True):
+        """Return the bank for these parameters, building it on a miss."""
+        freqs = np.asarray(freqs, dtype=float)
+        key = (tuple(freqs), float(srate),
+               tuple(np.broadcast_to(np.asarray(n_cycles, dtype=float), freqs.shape)),
+               int(n_times), bool(zero_mean))
+
+        if key in self._banks:
+            self._banks.move_to_end(key)
+            return self._banks[key]
+
+        bank = MorletBank(freqs, srate, n_cycles, n_times, zero_mean=zero_mean)
+        self._banks[key] = bank
+        # Evict least recently used banks, but always keep the new one
+        while self.nbytes > self.max_bytes and len(self._banks) > 1:
+            self._banks.popitem(last=False)
+
+        return bank
+
+# Module-level cache shared by the functions below
+morlet_bank_cache = MorletBankCache()
+
+def get_morlet_bank(freqs, srate, n_cycles=7.0, n_times=None, zero_mean=True):
+    """Fetch a MorletBank from the module cache (see MorletBankCache.get)."""
+    return morlet_bank_cache.get(freqs, srate, n_cycles, n_times, zero_mean=zero_mean)
+
 def wavelet_analysis(data, srate, freqs, n_cycles=7.0, use_fft=True, power=True):
     """
     Perform Morlet Wavelet time-frequency analysis.
@@ -17,7 +157,9 @@ def wavelet_analysis(data, srate, freqs, n_cycles=7.0, use_fft=True, power=True)
     n_cycles : float or array-like
         Number of cycles in the wavelet. Fixed number or one per frequency.
     use_fft : bool
-        Whether to use FFT for convolution (default True).
+        Whether to use FFT for convolution (default True). The FFT path uses
+        a cached MorletBank, so repeated calls with the same freqs, srate,
+        n_cycles and n_times only pay for the convolutions.
     power : bool
         Whether to return power (True) or complex values (False).
 
@@ -34,9 +176,13 @@ def wavelet_analysis(data, srate, freqs, n_cycles=7.0, use_fft=True, power=True)
         # Assume (n_epochs, n_times), add channel dim
         data = data[:, np.newaxis, :]
 
-    # MNE's tfr_array_morlet expects (n_epochs, n_channels, n_times)
     # output: (n_epochs, n_channels, n_freqs, n_times)
+    if use_fft:
+        # Kernel spectra are cached across calls with the same parameters
+        bank = get_morlet_bank(freqs, srate, n_cycles, data.shape[-1])
+        return bank.transform(data, output='power' if power else 'complex')
 
+    # MNE's tfr_array_morlet expects (n_epochs, n_channels, n_times)
     out = mne.time_frequency.tfr_array_morlet(
         data,
         sfreq=srate,
@@ -48,7 +194,115 @@ def wavelet_analysis(data, srate, freqs, n_cycles=7.0, use_fft=True, power=True)
 
     return out
 
-def simple_morlet_wrapper(data, freqs, srate, fwhm_time=0.5):
+def _wavelet_half_length(srate, freqs, n_cycles):
+    """Number of samples on each side of the longest Morlet wavelet."""
+    wavelets = mne.time_frequency.morlet(srate, freqs, n_cycles=n_cycles)
+    return max(len(w) for w in wavelets) // 2 + 1
+
+def wavelet_analysis_chunked(data, srate, freqs, n_cycles=7.0, use_fft=True,
+                             out_path=None, out=None, dtype=np.float32, decim=1,
+                             epoch_chunk=1, channel_chunk=16, time_chunk=None):
+    """
+    Out-of-core Morlet wavelet power, computed in (epoch, channel, time) blocks.
+
+    Each block is convolved with `wavelet_analysis` (cached kernels) and
+    written straight into the output, so peak memory is bounded by the block
+    size rather than by the full (n_epochs, n_channels, n_freqs, n_times)
+    result. Time blocks are extended by half the longest wavelet on both sides
+    and trimmed afterwards, so the result matches the unchunked transform.
+
+    Parameters:
+    -----------
+    data : array-like, shape (n_epochs, n_channels, n_times) or (n_epochs, n_times)
+        Input data (may itself be a np.memmap).
+    srate : float
+        Sampling rate.
+    freqs : array-like
+        Array of frequencies of interest.
+    n_cycles : float or array-like
+        Number of cycles in the wavelet. Fixed number or one per frequency.
+    use_fft : bool
+        Whether to use FFT for convolution (default True).
+    out_path : str | None
+        If given, power is written to a memory-mapped .npy file at this path.
+    out : array | None
+        Pre-allocated output of shape (n_epochs, n_channels, n_freqs, n_times_out).
+        Ignored if `out_path` is given.
+    dtype : numpy dtype
+        Output dtype (default float32).
+    decim : int
+        Keep every `decim`-th time sample of the output.
+    epoch_chunk, channel_chunk : int
+        Number of epochs / channels per block.
+    time_chunk : int | None
+        Number of output time samples per block (before decimation). None
+        processes whole epochs; set it for long continuous recordings.
+
+    Returns:
+    --------
+    out : array or np.memmap, (n_epochs, n_channels, n_freqs, n_times_out)
+        Power, with n_times_out = ceil(n_times / decim).
+    """
+    data = np.asarray(data)
+    if data.ndim == 2:
+        data = data[:, np.newaxis, :]
+
+    freqs = np.asarray(freqs, dtype=float)
+    n_epochs, n_channels, n_times = data.shape
+    n_freqs = len(freqs)
+    n_times_out = -(-n_times // decim)
+    shape = (n_epochs, n_channels, n_freqs, n_times_out)
+
+    if out_path is not None:
+        out = np.lib.format.open_memmap(out_path, mode='w+', dtype=dtype, shape=shape)
+    elif out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError(f"out has shape {out.shape}, expected {shape}")
+
+    half = _wavelet_half_length(srate, freqs, n_cycles)
+    if time_chunk is None:
+        time_chunk = n_times
+    else:
+        # Blocks must hold the longest wavelet and start on the decimation grid
+        time_chunk = max(int(time_chunk), 2 * half)
+        time_chunk = -(-time_chunk // decim) * decim
+
+    for e0 in range(0, n_epochs, epoch_chunk):
+        e1 = min(e0 + epoch_chunk, n_epochs)
+        for c0 in range(0, n_channels, channel_chunk):
+            c1 = min(c0 + channel_chunk, n_channels)
+            for t0 in range(0, n_times, time_chunk):
+                t1 = min(t0 + time_chunk, n_times)
+
+                # Pad with neighbouring samples, trim after convolution
+                # (a short last block takes more context from the left)
+                p1 = min(t1 + half, n_times)
+                p0 = max(min(t0 - half, p1 - 2 * half), 0)
+                block = np.asarray(data[e0:e1, c0:c1, p0:p1], dtype=np.float64)
+
+                power = wavelet_analysis(block, srate, freqs, n_cycles=n_cycles,
+                                         use_fft=use_fft, power=True)
+                power = power[..., t0 - p0:t1 - p0:decim]
+
+                out[e0:e1, c0:c1, :, t0 // decim:t0 // decim + power.shape[-1]] = power
+
+    if isinstance(out, np.memmap):
+        out.flush()
+
+    return out
+
+def fwhm_to_n_cycles(freqs, fwhm_time):
+    """
+    Convert a Gaussian FWHM in seconds to MNE's n_cycles, per frequency.
+
+    MATLAB: exp( -4 * log(2) * t^2 / fwhm^2 ), MNE: exp( -t^2 / (2 * sigma^2) )
+    so sigma = fwhm / (2 * sqrt(2*log(2))) and n_cycles = sigma * 2 * pi * f.
+    """
+    sigma = fwhm_time / (2 * np.sqrt(2 * np.log(2)))
+    return sigma * 2 * np.pi * np.asarray(freqs)
+
+def simple_morlet_wrapper(data, freqs, srate, fwhm_time=0.5, out_path=None, **chunk_kwargs):
     """
     A wrapper closer to the MATLAB implementation provided.
 
@@ -58,6 +312,10 @@ def simple_morlet_wrapper(data, freqs, srate, fwhm_time=0.5):
     freqs : array, frequencies
     srate : float
     fwhm_time : float, Full Width Half Max in seconds (approximates n_cycles)
+    out_path : str | None
+        If given, compute out-of-core with `wavelet_analysis_chunked` and write
+        power to a memory-mapped .npy file at this path. Extra keyword
+        arguments (dtype, decim, epoch_chunk, time_chunk...) are passed on.
 
     Returns:
     --------
@@ -86,19 +344,22 @@ def simple_morlet_wrapper(data, freqs, srate, fwhm_time=0.5):
     # n_cycles = 6 * sigma * f (usually defined as such in MNE for sigma being standard dev)
     # actually MNE: n_cycles = sigma * 2 * pi * f
 
-    sigma = fwhm_time / (2 * np.sqrt(2 * np.log(2)))
-    n_cycles = sigma * 2 * np.pi * freqs
+    n_cycles = fwhm_to_n_cycles(freqs, fwhm_time)
 
-    power = mne.time_frequency.tfr_array_morlet(
-        data_reshaped, srate, freqs, n_cycles=n_cycles, output='power'
-    )
+    if out_path is not None:
+        power = wavelet_analysis_chunked(
+            data_reshaped, srate, freqs, n_cycles=n_cycles, out_path=out_path, **chunk_kwargs
+        )
+    else:
+        power = wavelet_analysis(data_reshaped, srate, freqs, n_cycles=n_cycles)
 
     # MNE output: (n_epochs, n_channels, n_freqs, n_times)
     # We want: (n_freqs, n_times, n_trials) to match MATLAB roughly
     # (MATLAB out: freq, time, trial)
 
     # power shape: (n_trials, 1, n_freqs, n_samples)
-    power = power.squeeze(1) # (n_trials, n_freqs, n_samples)
+    # (transposes are views, so a memmap result stays on disk)
+    power = power[:, 0] # (n_trials, n_freqs, n_samples)
     power = np.transpose(power, (1, 2, 0)) # (n_freqs, n_samples, n_trials)
 
     return power
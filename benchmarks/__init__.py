@@ -0,0 +1,20 @@
+"""
+Benchmark suite for the Python analysis entry points.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --scale small --output results.json
+    python -m benchmarks.run_benchmarks --scale small --compare results.json
+"""
+import os
+import sys
+
+# The analysis modules are flat scripts importing their siblings, so put
+# their directories on the path
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _subdir in ('TimeFre_analysis/Hilbert', 'TimeFre_analysis/STFT',
+                'TimeFre_analysis/Wavelet_transform', 'spectral_analysis/mne',
+                'microstate_analysis/mne'):
+    _path = os.path.join(_ROOT, _subdir)
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
@@ -0,0 +1,249 @@
+"""
+Benchmarks of the Python analysis entry points (timing and peak memory).
+
+Run as a module from the repository root (the relative imports do not work
+when the file is run as a script):
+
+    python -m benchmarks.run_benchmarks --scale small --output results.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+import numpy as np
+import mne
+
+from . import synthetic
+from hilbert_analysis import hilbert_analysis
+from stft_analysis import stft_analysis
+from wavelet_analysis import wavelet_analysis
+from spectral_methods import compute_psd_fft, compute_psd_welch
+from microstate_methods import (segment_microstates, smooth_segmentation, calculate_statistics,
+                                backfit)
+
+FREQUENCY_BANDS = [[4, 8], [8, 13], [13, 30], [30, 45]]
+WAVELET_FREQS = np.linspace(4, 40, 10)
+# freqs / 2 cycles keep every wavelet shorter than 1 s
+WAVELET_CYCLES = WAVELET_FREQS / 2
+
+# Every case takes the scale dict and returns (func, args, kwargs, n_samples),
+# where n_samples is the number of input samples (all channels/trials) the
+# call processes. Data generation is not timed.
+
+def _hilbert_case(scale):
+    trials = synthetic.create_dummy_trials(scale['n_trials'], 1, scale['n_samples'], scale['sfreq'])
+    data = trials[:, 0].T # (n_samples, n_trials)
+    return hilbert_analysis, (data, scale['sfreq'], FREQUENCY_BANDS), {}, data.size
+
+def _stft_case(scale):
+    trials = synthetic.create_dummy_trials(scale['n_trials'], 1, scale['n_samples'], scale['sfreq'])
+    data = trials[:, 0].T
+    return stft_analysis, (data, scale['sfreq']), dict(freqs=(1, 45)), data.size
+
+def _wavelet_case(scale):
+    data = synthetic.create_dummy_trials(scale['n_trials'], scale['n_channels'],
+                                         scale['n_samples'], scale['sfreq'])
+    return (wavelet_analysis, (data, scale['sfreq'], WAVELET_FREQS),
+            dict(n_cycles=WAVELET_CYCLES), data.size)
+
+def _raw_size(raw):
+    return len(raw.ch_names) * raw.n_times
+
+def _psd_fft_case(scale):
+    raw = synthetic.create_dummy_raw(scale['n_channels'], scale['raw_duration'], scale['sfreq'])
+    return compute_psd_fft, (raw,), dict(fmin=1, fmax=100), _raw_size(raw)
+
+def _psd_welch_case(scale):
+    raw = synthetic.create_dummy_raw(scale['n_channels'], scale['raw_duration'], scale['sfreq'])
+    return compute_psd_welch, (raw,), dict(fmin=1, fmax=100, n_fft=1024), _raw_size(raw)
+
+def _microstate_raw(scale):
+    return synthetic.create_dummy_microstate_raw(scale['n_channels'], scale['raw_duration'],
+                                                 scale['sfreq'])
+
+def _segment_case(scale):
+    raw = _microstate_raw(scale)
+    return segment_microstates, (raw,), dict(n_states=4, random_state=0), _raw_size(raw)
+
+def _segmentation(scale):
+    raw = _microstate_raw(scale)
+    maps, segmentation, _ = segment_microstates(raw, n_states=4, random_state=0)
+    return raw, maps, segmentation
+
+def _smooth_case(scale):
+    raw, maps, segmentation = _segmentation(scale)
+    min_duration = int(0.03 * scale['sfreq'])
+    return (smooth_segmentation, (segmentation,),
+            dict(min_duration=min_duration, data=raw.get_data(), maps=maps), len(segmentation))
+
+def _statistics_case(scale):
+    raw, maps, segmentation = _segmentation(scale)
+    data = raw.get_data()
+    gfp = np.std(data, axis=0)
+    # With the backfit correlations the per-state GEV is computed as well
+    _, corr, _ = backfit(data, maps)
+    return (calculate_statistics, (segmentation,),
+            dict(sfreq=scale['sfreq'], n_states=4, gfp=gfp, corr=corr), len(segmentation))
+
+CASES = {
+    'hilbert_analysis': _hilbert_case,
+    'stft_analysis': _stft_case,
+    'wavelet_analysis': _wavelet_case,
+    'compute_psd_fft': _psd_fft_case,
+    'compute_psd_welch': _psd_welch_case,
+    'segment_microstates': _segment_case,
+    'smooth_segmentation': _smooth_case,
+    'calculate_statistics': _statistics_case,
+}
+
+def measure(func, args, kwargs, n_samples, repeats=3):
+    """
+    Time `func(*args, **kwargs)` and measure its peak memory.
+
+    The wall time is taken over `repeats` runs without tracing; the peak
+    memory comes from one extra run under tracemalloc (numpy reports its
+    buffers to tracemalloc), relative to the memory in use before the call.
+
+    Returns:
+    --------
+    result : dict
+        'wall_time' (best of repeats, s), 'wall_time_median', 'peak_memory_mb',
+        'n_samples' and 'throughput' (samples/s, from the best time).
+    """
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        out = func(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+        del out
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    out = func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    del out
+
+    best = min(times)
+    return {
+        'wall_time': best,
+        'wall_time_median': float(np.median(times)),
+        'peak_memory_mb': peak / 1024**2,
+        'n_samples': int(n_samples),
+        'throughput': n_samples / best,
+    }
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(scale='small', cases=None, repeats=3, **overrides):
+    """
+    Run the benchmark cases at one scale.
+
+    Parameters:
+    -----------
+    scale : str
+        Key of synthetic.SCALES.
+    cases : list of str | None
+        Names of CASES to run (default: all).
+    repeats : int
+        Timed runs per case.
+    **overrides
+        Replace entries of the scale (n_channels, n_trials, n_samples, sfreq,
+        raw_duration).
+
+    Returns:
+    --------
+    report : dict
+        'commit', 'timestamp', 'versions', 'scale' and 'results'
+        (case name -> measure() dict, or {'error': ...}).
+    """
+    params = dict(synthetic.SCALES[scale], **{k: v for k, v in overrides.items() if v is not None})
+    if cases is None:
+        cases = list(CASES)
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'versions': {'python': platform.python_version(), 'numpy': np.__version__,
+                     'mne': mne.__version__, 'machine': platform.machine()},
+        'scale': dict(params, name=scale),
+        'results': {},
+    }
+
+    for name in cases:
+        print(f"Running {name}...")
+        try:
+            func, args, kwargs, n_samples = CASES[name](params)
+            report['results'][name] = measure(func, args, kwargs, n_samples, repeats=repeats)
+        except Exception as e:
+            print(f"  failed: {type(e).__name__}: {e}")
+            report['results'][name] = {'error': f"{type(e).__name__}: {e}"}
+
+    return report
+
+def print_report(report, baseline=None):
+    """Table of the results; with a baseline report, the time/memory ratios too."""
+    print(f"\nCommit {report['commit']}, scale {report['scale']['name']}")
+    header = f"{'function':<24}{'time (s)':>10}{'peak MB':>10}{'Msamples/s':>12}"
+    if baseline is not None:
+        header += f"{'time vs base':>14}{'mem vs base':>13}"
+    print(header)
+
+    for name, result in report['results'].items():
+        if 'error' in result:
+            print(f"{name:<24}  {result['error']}")
+            continue
+        line = (f"{name:<24}{result['wall_time']:>10.3f}{result['peak_memory_mb']:>10.1f}"
+                f"{result['throughput'] / 1e6:>12.2f}")
+        base = baseline['results'].get(name, {}) if baseline is not None else {}
+        if 'wall_time' in base:
+            line += (f"{result['wall_time'] / base['wall_time']:>13.2f}x"
+                     f"{result['peak_memory_mb'] / max(base['peak_memory_mb'], 1e-6):>12.2f}x")
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Python analysis entry points.')
+    parser.add_argument('--scale', default='small', choices=list(synthetic.SCALES))
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=None)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--n-channels', type=int)
+    parser.add_argument('--n-trials', type=int)
+    parser.add_argument('--n-samples', type=int)
+    parser.add_argument('--sfreq', type=float)
+    parser.add_argument('--raw-duration', type=float)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare against')
+    args = parser.parse_args()
+
+    mne.set_log_level('ERROR')
+    report = run_benchmarks(args.scale, args.cases, args.repeats, n_channels=args.n_channels,
+                            n_trials=args.n_trials, n_samples=args.n_samples, sfreq=args.sfreq,
+                            raw_duration=args.raw_duration)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['scale'] != report['scale']:
+            print(f"Warning: baseline scale {baseline['scale']} differs from {report['scale']}",
+                  file=sys.stderr)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import numpy as np
+import mne
+
+# Data sizes per scale. Trial data are (n_trials, n_channels, n_samples) at
+# sfreq; continuous data are n_channels x raw_duration seconds.
+SCALES = {
+    'small': dict(n_channels=16, n_trials=20, n_samples=1000, sfreq=500.0, raw_duration=60.0),
+    'medium': dict(n_channels=32, n_trials=50, n_samples=2000, sfreq=500.0, raw_duration=600.0),
+    'large': dict(n_channels=64, n_trials=100, n_samples=4000, sfreq=1000.0, raw_duration=1800.0),
+}
+
+def create_dummy_trials(n_trials, n_channels, n_samples, sfreq, seed=42):
+    """Noisy 10 Hz oscillation, (n_trials, n_channels, n_samples)."""
+    rng = np.random.RandomState(seed)
+    times = np.arange(n_samples) / sfreq
+    data = rng.randn(n_trials, n_channels, n_samples)
+    data += np.sin(2 * np.pi * 10 * times)
+    return data
+
+def create_dummy_raw(n_channels, duration, sfreq, seed=42):
+    """Raw with 10 and 50 Hz sines plus white noise."""
+    rng = np.random.RandomState(seed)
+    n_times = int(duration * sfreq)
+    times = np.arange(n_times) / sfreq
+    data = rng.randn(n_channels, n_times)
+    data += np.sin(2 * np.pi * 10 * times) + 0.5 * np.sin(2 * np.pi * 50 * times)
+    info = mne.create_info([f'EEG{i:03d}' for i in range(n_channels)], sfreq, 'eeg')
+    return mne.io.RawArray(data * 1e-6, info, verbose=False)
+
+def create_dummy_microstate_raw(n_channels, duration, sfreq, n_states=4, seed=42):
+    """
+    Raw whose topography switches between `n_states` random maps every
+    50-150 ms, modulated by a 10 Hz oscillation, plus noise.
+    """
+    rng = np.random.RandomState(seed)
+    n_times = int(duration * sfreq)
+    times = np.arange(n_times) / sfreq
+
+    maps = rng.randn(n_states, n_channels)
+    maps /= np.linalg.norm(maps, axis=1, keepdims=True)
+
+    # Random state sequence with 50-150 ms segments
+    lengths = rng.randint(int(0.05 * sfreq), int(0.15 * sfreq) + 1, size=n_times // int(0.05 * sfreq) + 1)
+    labels = np.repeat(rng.randint(n_states, size=len(lengths)), lengths)[:n_times]
+
+    data = maps[labels].T * np.abs(np.sin(2 * np.pi * 10 * times))
+    data += 0.1 * rng.randn(n_channels, n_times)
+    info = mne.create_info([f'EEG{i:03d}' for i in range(n_channels)], sfreq, 'eeg')
+    return mne.io.RawArray(data * 1e-6, info, verbose=False)
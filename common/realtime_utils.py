@@ -0,0 +1,16 @@
+import time
+
+def simulate_stream(raw, chunk_duration=0.05, realtime=False):
+    """Yield (time, chunk) pairs from a Raw, optionally at real-time rate."""
+    sfreq = raw.info['sfreq']
+    chunk_size = int(round(chunk_duration * sfreq))
+    data = raw.get_data()
+    t_start = time.perf_counter()
+    for start in range(0, data.shape[1], chunk_size):
+        stop = min(start + chunk_size, data.shape[1])
+        if realtime:
+            # Wait until the chunk would have been acquired
+            delay = stop / sfreq - (time.perf_counter() - t_start)
+            if delay > 0:
+                time.sleep(delay)
+        yield stop / sfreq, data[:, start:stop]
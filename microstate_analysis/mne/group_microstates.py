@@ -0,0 +1,289 @@
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import mne
+
+from microstate_methods import (extract_gfp_peaks_streaming, modified_kmeans, backfit,
+                                StreamingStatistics)
+
+def _subject_name(file_path):
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+def _input_fingerprint(file_path):
+    """JSON of [name, size, mtime_ns] of a recording and its data files (e.g. .fdt)."""
+    raw = mne.io.read_raw(file_path, preload=False, verbose=False)
+    files = [os.path.abspath(file_path)] + [os.path.abspath(str(f)) for f in raw.filenames
+                                            if f is not None]
+    stats = []
+    for f in sorted(set(files)):
+        st = os.stat(f)
+        stats.append([os.path.basename(f), st.st_size, st.st_mtime_ns])
+    return json.dumps(stats)
+
+def _map(func, args_list, n_jobs):
+    """func(*args) for every args tuple, in a process pool if n_jobs > 1."""
+    if n_jobs == 1:
+        return [func(*args) for args in args_list]
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(func, *args) for args in args_list]
+        return [f.result() for f in futures]
+
+def _save_npz(path, **arrays):
+    # Write-then-rename so an interrupted run never leaves a truncated file
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+def fit_individual_maps(file_path, output_dir, n_states=4, max_peaks=10000, block_size=100000,
+                        picks='eeg', n_init=10, max_iter=300, tol=1e-6, random_state=None):
+    """
+    Cluster one subject's GFP peak maps into individual microstate maps.
+
+    The recording is read block by block (not preloaded), at most
+    `max_peaks` peak maps are kept, and the result is saved to
+    `output_dir/<subject>_individual.npz` together with the fit parameters
+    and the size and mtime of the input file. If that file exists and was
+    fitted with the same parameters on the unchanged input, it is reused;
+    otherwise the maps are refitted.
+
+    Returns:
+    --------
+    path : str
+        The .npz file with 'maps' (n_states, n_channels), 'gev', 'n_peaks',
+        'ch_names', 'sfreq', 'params' (JSON of the fit parameters) and
+        'input' (JSON of the input files' names, sizes and mtimes).
+    """
+    path = os.path.join(output_dir, f'{_subject_name(file_path)}_individual.npz')
+    params = json.dumps({'n_states': n_states, 'max_peaks': max_peaks, 'block_size': block_size,
+                         'picks': picks, 'n_init': n_init, 'max_iter': max_iter, 'tol': tol,
+                         'random_state': random_state}, sort_keys=True, default=str)
+    fingerprint = _input_fingerprint(file_path)
+    if os.path.exists(path):
+        with np.load(path) as npz:
+            if ('params' in npz and str(npz['params']) == params
+                    and 'input' in npz and str(npz['input']) == fingerprint):
+                return path
+        print(f"[{_subject_name(file_path)}] Input file or fit parameters changed, "
+              f"refitting individual maps")
+
+    t0 = time.perf_counter()
+    raw = mne.io.read_raw(file_path, preload=False, verbose=False)
+    ch_names = raw.copy().pick(picks).ch_names
+    peak_maps, _, n_peaks = extract_gfp_peaks_streaming(raw, block_size=block_size,
+                                                        max_peaks=max_peaks, picks=picks,
+                                                        random_state=random_state)
+    maps, _, gev, _ = modified_kmeans(peak_maps, n_states=n_states, n_init=n_init,
+                                      max_iter=max_iter, tol=tol, random_state=random_state)
+    _save_npz(path, maps=maps, gev=gev, n_peaks=n_peaks, ch_names=np.array(ch_names),
+              sfreq=raw.info['sfreq'], params=params, input=fingerprint)
+    print(f"[{_subject_name(file_path)}] {n_peaks} GFP peaks, individual GEV {gev:.3f} "
+          f"({time.perf_counter() - t0:.1f} s)")
+    return path
+
+def backfit_subject(file_path, group_maps, output_dir, block_size=100000, picks='eeg'):
+    """
+    Backfit group maps to one subject and save the results.
+
+    Labels (int8) and correlations (float32) are written to .npy memmaps
+    `output_dir/<subject>_labels.npy` and `<subject>_corr.npy` in blocks of
+    `block_size` samples. Per-state GEV and the microstate statistics are
+    accumulated over the same blocks (StreamingStatistics, segments spanning
+    blocks are counted once) and go to `<subject>_stats.npz`, so memory does
+    not grow with the recording length. Existing results are reused unless
+    the input file changed.
+
+    Returns:
+    --------
+    path : str
+        The `_stats.npz` file ('state_gev', 'duration', 'occurrence',
+        'coverage', 'transition').
+    """
+    subject = _subject_name(file_path)
+    stats_path = os.path.join(output_dir, f'{subject}_stats.npz')
+    fingerprint = _input_fingerprint(file_path)
+    if os.path.exists(stats_path):
+        with np.load(stats_path) as npz:
+            if 'input' in npz and str(npz['input']) == fingerprint:
+                return stats_path
+
+    raw = mne.io.read_raw(file_path, preload=False, verbose=False)
+    n_states = len(group_maps)
+    # A plain int: numpy 2 writes np.int64(...) into the .npy header otherwise
+    n_times = int(raw.n_times)
+    labels_mm = np.lib.format.open_memmap(os.path.join(output_dir, f'{subject}_labels.npy'),
+                                          mode='w+', dtype=np.int8, shape=(n_times,))
+    corr_mm = np.lib.format.open_memmap(os.path.join(output_dir, f'{subject}_corr.npy'),
+                                        mode='w+', dtype=np.float32, shape=(n_times,))
+
+    # backfit() keeps the full label/corr arrays in memory, so feed it one
+    # block at a time and accumulate the statistics here
+    accumulator = StreamingStatistics(n_states=n_states, sfreq=raw.info['sfreq'])
+    for start in range(0, raw.n_times, block_size):
+        stop = min(start + block_size, raw.n_times)
+        x = raw.get_data(picks=picks, start=start, stop=stop)
+        labels, corr, _ = backfit(x, group_maps, chunk_size=block_size)
+        labels_mm[start:stop] = labels
+        corr_mm[start:stop] = corr
+        accumulator.update(labels, gfp=np.std(x, axis=0), corr=corr)
+    labels_mm.flush()
+    corr_mm.flush()
+
+    stats = accumulator.result()
+    _save_npz(stats_path, state_gev=stats.pop('gev'), input=fingerprint, **stats)
+    del labels_mm, corr_mm
+    return stats_path
+
+def group_microstates(file_paths, output_dir, n_states=4, n_jobs=1, max_peaks=10000,
+                      block_size=100000, picks='eeg', n_init=10, group_n_init=100,
+                      max_iter=300, tol=1e-6, random_state=None):
+    """
+    Two-level group microstate analysis with bounded memory.
+
+    1. Per subject (in parallel workers): GFP peak maps are extracted block
+       by block and clustered into individual maps (fit_individual_maps).
+    2. The individual maps of all subjects are meta-clustered with modified
+       K-means into group template maps (the input is only
+       n_subjects * n_states maps).
+    3. Per subject (in parallel workers): the group maps are backfitted and
+       labels, correlations and statistics are written to disk
+       (backfit_subject).
+
+    No stage holds more than one subject's data block per worker. Every
+    intermediate result is an .npz/.npy file in `output_dir`, so an
+    interrupted run resumes where it stopped. Individual maps fitted with
+    other parameters, and backfits of other group maps, are recomputed.
+
+    Parameters:
+    -----------
+    file_paths : list of str
+        One (preprocessed, average-referenced) recording per subject.
+    output_dir : str
+        Directory for the intermediate and final results.
+    n_states : int
+        Number of microstates, for the individual and the group level.
+    n_jobs : int
+        Number of worker processes for the per-subject stages.
+    max_peaks : int | None
+        Maximum number of GFP peaks kept per subject.
+    block_size : int
+        Number of samples read at a time.
+    picks : str | list
+        Channels to use; must give the same channels for every subject.
+    n_init : int
+        Restarts of the individual clustering.
+    group_n_init : int
+        Restarts of the meta-clustering.
+    max_iter, tol :
+        Passed to `modified_kmeans`.
+    random_state : int | None
+        Seed for peak subsampling and clustering.
+
+    Returns:
+    --------
+    results : dict
+        'subjects' : list of subject names.
+        'group_maps' : array, shape (n_states, n_channels), sorted by mean GEV.
+        'ch_names' : list of channel names.
+        'state_gev' : array, shape (n_subjects, n_states).
+        'gev' : array, total GEV of the group maps per subject.
+        'duration', 'occurrence', 'coverage' : arrays, shape (n_subjects, n_states).
+        'transition' : array, shape (n_subjects, n_states, n_states).
+        'label_order' : array, the `_labels.npy` files index the unsorted
+            group maps; sorted state k has label label_order[k] there.
+        The same arrays are saved to `output_dir/group_results.npz`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    subjects = [_subject_name(f) for f in file_paths]
+    if len(set(subjects)) != len(subjects):
+        raise ValueError("Subject file names must be unique")
+
+    # 1. Individual maps
+    print(f"Fitting individual maps for {len(file_paths)} subjects...")
+    fit_args = (output_dir, n_states, max_peaks, block_size, picks, n_init, max_iter, tol,
+                random_state)
+    individual_paths = _map(fit_individual_maps, [(f,) + fit_args for f in file_paths], n_jobs)
+
+    individual_maps = []
+    ch_names = None
+    for subject, path in zip(subjects, individual_paths):
+        with np.load(path) as npz:
+            if ch_names is None:
+                ch_names = list(npz['ch_names'])
+            elif list(npz['ch_names']) != ch_names:
+                raise ValueError(f"Channels of {subject} differ from those of {subjects[0]}")
+            individual_maps.append(npz['maps'])
+    individual_maps = np.concatenate(individual_maps)
+
+    # 2. Meta-clustering of the (unit-norm) individual maps
+    group_path = os.path.join(output_dir, 'group_maps.npz')
+    print(f"Meta-clustering {len(individual_maps)} individual maps...")
+    group_maps, _, meta_gev, _ = modified_kmeans(individual_maps, n_states=n_states,
+                                                 n_init=group_n_init, max_iter=max_iter, tol=tol,
+                                                 random_state=random_state)
+    print(f"Meta-clustering GEV: {meta_gev:.3f}")
+
+    # 3. Backfitting. The saved group maps are only reused if they match,
+    # otherwise old per-subject backfits are stale
+    if os.path.exists(group_path):
+        with np.load(group_path) as npz:
+            stale = npz['maps'].shape != group_maps.shape or not np.allclose(npz['maps'], group_maps)
+        if stale:
+            for subject in subjects:
+                stats_path = os.path.join(output_dir, f'{subject}_stats.npz')
+                if os.path.exists(stats_path):
+                    os.remove(stats_path)
+    _save_npz(group_path, maps=group_maps, gev=meta_gev, ch_names=np.array(ch_names))
+
+    print("Backfitting group maps...")
+    backfit_args = (group_maps, output_dir, block_size, picks)
+    stats_paths = _map(backfit_subject, [(f,) + backfit_args for f in file_paths], n_jobs)
+
+    keys = ('state_gev', 'duration', 'occurrence', 'coverage', 'transition')
+    results = {key: [] for key in keys}
+    for path in stats_paths:
+        with np.load(path) as npz:
+            for key in keys:
+                results[key].append(npz[key])
+    results = {key: np.stack(values) for key, values in results.items()}
+
+    # Sort states by mean GEV across subjects (descending)
+    order = np.argsort(results['state_gev'].mean(axis=0))[::-1]
+    for key in ('state_gev', 'duration', 'occurrence', 'coverage'):
+        results[key] = results[key][:, order]
+    results['transition'] = results['transition'][:, order][:, :, order]
+    results['gev'] = results['state_gev'].sum(axis=1)
+    results['group_maps'] = group_maps[order]
+    results['label_order'] = order
+
+    _save_npz(os.path.join(output_dir, 'group_results.npz'), subjects=np.array(subjects),
+              ch_names=np.array(ch_names), **results)
+    results['subjects'] = subjects
+    results['ch_names'] = ch_names
+    return results
+
+if __name__ == "__main__":
+    # Example: 6 simulated subjects sharing 4 maps (with subject-specific noise)
+    output_dir = 'group_microstates_output'
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.RandomState(42)
+    sfreq, n_ch, n_times = 250.0, 30, 30000
+    maps = rng.randn(4, n_ch)
+    maps -= maps.mean(axis=1, keepdims=True)
+
+    file_paths = []
+    for i in range(6):
+        labels = np.repeat(rng.randint(4, size=n_times // 20 + 1), 20)[:n_times]
+        subject_maps = maps + 0.2 * rng.randn(4, n_ch)
+        data = subject_maps[labels].T * np.abs(np.sin(2 * np.pi * 10 * np.arange(n_times) / sfreq))
+        data = (data + 0.1 * rng.randn(n_ch, n_times)) * 1e-6
+        info = mne.create_info([f'EEG{c:02d}' for c in range(n_ch)], sfreq, 'eeg')
+        file_path = os.path.join(output_dir, f'sub-{i:02d}_raw.fif')
+        mne.io.RawArray(data, info, verbose=False).save(file_path, overwrite=True, verbose=False)
+        file_paths.append(file_path)
+
+    results = group_microstates(file_paths, output_dir, n_states=4, n_jobs=2, random_state=42)
+    print("\nGEV per subject:", np.round(results['gev'], 3))
+    print("Mean coverage per state:", np.round(results['coverage'].mean(axis=0), 3))
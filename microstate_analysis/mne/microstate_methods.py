@@ -1,6 +1,11 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
 import numpy as np
-from sklearn.cluster import KMeans
-from scipy.signal import find_peaks
+from scipy.ndimage import maximum_filter1d
 
 def calculate_gfp(data):
     """
@@ -26,9 +31,592 @@ def calculate_gfp(data):
     gfp = np.std(data, axis=0)
     return gfp
 
-def segment_microstates(inst, n_states=4, random_state=None, n_init=10):
+def modified_kmeans(X, n_states=4, n_init=10, max_iter=300, tol=1e-6,
+                    random_state=None, verbose=False):
+    """
+    Polarity-invariant modified K-means (Pascual-Marqui et al., 1995).
+
+    All `n_init` restarts are run together: assignment is a single matrix
+    product (n_init * n_states, n_channels) @ (n_channels, n_samples),
+    samples are assigned to the map with the highest absolute correlation,
+    and each map is updated to the (sign-invariant) principal direction of
+    its samples with one power-iteration step.
+
+    Parameters:
+    -----------
+    X : array, shape (n_samples, n_channels)
+        Maps to cluster, typically the data at GFP peaks (not normalized,
+        so samples are weighted by their GFP).
+    n_states : int
+        Number of clusters.
+    n_init : int
+        Number of random restarts, the one with the highest GEV is returned.
+    max_iter : int
+        Maximum number of iterations.
+    tol : float
+        Stop when the relative GEV change of every restart is below `tol`.
+    random_state : int | None
+        Seed for the initialization.
+    verbose : bool
+        Print GEV and wall time of every iteration.
+
+    Returns:
+    --------
+    maps : array, shape (n_states, n_channels)
+        Unit-norm cluster maps of the best restart.
+    labels : array, shape (n_samples,)
+        Cluster index of each sample.
+    gev : float
+        Global Explained Variance of the best restart on X.
+    info : dict
+        'n_iter', 'iter_times' (s per iteration), 'gev_history'
+        (n_iter, n_init) and 'best_init'.
+    """
+    X = np.asarray(X)
+    n_samples, n_ch = X.shape
+    if n_samples < n_states:
+        raise ValueError(f"Need at least n_states={n_states} samples, got {n_samples}")
+
+    rng = np.random.RandomState(random_state)
+
+    # Per-sample GEV weight: (gfp * corr)^2 = gfp^2 / ||x||^2 * (x . map)^2
+    gfp = np.std(X, axis=1)
+    gfp_sum_sq = np.sum(gfp**2)
+    weight = gfp**2 / (np.sum(X**2, axis=1) + 1e-16)
+
+    # Initialize each restart with distinct random samples
+    init_idx = np.array([rng.choice(n_samples, n_states, replace=False) for _ in range(n_init)])
+    maps = X[init_idx] # (n_init, n_states, n_ch)
+    maps = maps / (np.linalg.norm(maps, axis=2, keepdims=True) + 1e-16)
+
+    state_ids = np.arange(n_states)[np.newaxis, :, np.newaxis]
+    gev_prev = np.full(n_init, -np.inf)
+    gev_history = []
+    iter_times = []
+
+    for n_iter in range(1, max_iter + 1):
+        t0 = time.perf_counter()
+
+        # Assignment: absolute projection on every map, all restarts stacked
+        # into one (n_init * n_states, n_ch) matrix for a single BLAS call
+        proj = (maps.reshape(-1, n_ch) @ X.T).reshape(n_init, n_states, n_samples)
+        labels = np.argmax(np.abs(proj), axis=1) # (n_init, n_samples)
+
+        # Update: map_k <- X_k^T X_k map_k, the sign of x . map_k cancels polarity
+        member = labels[:, np.newaxis, :] == state_ids
+        new_maps = np.where(member, proj, 0).reshape(-1, n_samples) @ X
+        new_maps = new_maps.reshape(n_init, n_states, n_ch)
+        norms = np.linalg.norm(new_maps, axis=2, keepdims=True)
+        # Keep the previous map for empty clusters
+        maps = np.where(norms > 0, new_maps / np.maximum(norms, 1e-16), maps)
+
+        best_proj = np.take_along_axis(proj, labels[:, np.newaxis, :], axis=1)[:, 0]
+        gev = (weight * best_proj**2).sum(axis=1) / gfp_sum_sq
+
+        iter_times.append(time.perf_counter() - t0)
+        gev_history.append(gev)
+        if verbose:
+            print(f"Iteration {n_iter}: best GEV={gev.max():.4f} ({iter_times[-1] * 1000:.1f} ms)")
+
+        if np.all(np.abs(gev - gev_prev) <= tol * np.abs(gev)):
+            break
+        gev_prev = gev
+
+    # Final assignment with the converged maps
+    proj = (maps.reshape(-1, n_ch) @ X.T).reshape(n_init, n_states, n_samples)
+    labels = np.argmax(np.abs(proj), axis=1)
+    best_proj = np.take_along_axis(proj, labels[:, np.newaxis, :], axis=1)[:, 0]
+    gev = (weight * best_proj**2).sum(axis=1) / gfp_sum_sq
+
+    best = int(np.argmax(gev))
+    info = {
+        'n_iter': n_iter,
+        'iter_times': np.array(iter_times),
+        'gev_history': np.array(gev_history),
+        'best_init': best,
+    }
+
+    return maps[best], labels[best], float(gev[best]), info
+
+class MiniBatchModifiedKMeans:
+    """
+    Mini-batch, polarity-invariant modified K-means for very large peak sets.
+
+    The maps are initialized by `modified_kmeans` on the first batch. Each
+    further batch is assigned to the current maps (highest absolute
+    correlation), the running scatter matrix of every state is decayed by
+    `decay` and the batch's scatter X_k^T X_k is added, and each map takes
+    one power-iteration step on its scatter matrix, i.e. moves towards the
+    principal (sign-invariant) direction of the recently assigned samples.
+    The decay lets assignments made with early, still inaccurate maps fade
+    out. A batch costs one (n_states, n_ch) @ (n_ch, batch_size) product,
+    and only the batch and the (n_states, n_ch, n_ch) scatter matrices are
+    held in memory.
+
+    Parameters:
+    -----------
+    n_states : int
+        Number of clusters.
+    batch_size : int
+        Number of samples per mini-batch in fit().
+    max_iter : int
+        Maximum number of passes over the data in fit().
+    tol : float
+        Converged once the map change (largest 1 - |cos| between consecutive
+        maps), averaged over the last 10 batches, is at most tol. The default
+        matches `segment_microstates`.
+    decay : float
+        Weight of the previous scatter matrices at every batch (0-1); the
+        scatter covers about 1 / (1 - decay) recent batches.
+    n_init : int
+        Restarts of the `modified_kmeans` initialization on the first batch.
+    random_state : int | None
+        Seed for the initialization and the batch order.
+    verbose : bool
+        Print the batch GEV and map change after every batch.
+
+    Attributes:
+    -----------
+    maps_ : array, shape (n_states, n_channels)
+        Unit-norm cluster maps.
+    n_steps_ : int
+        Number of batches processed.
+    n_samples_seen_ : int
+        Number of samples processed.
+    converged_ : bool
+        Whether the running map change met the tolerance.
+    """
+
+    def __init__(self, n_states=4, batch_size=4096, max_iter=100, tol=1e-6, decay=0.99,
+                 n_init=10, random_state=None, verbose=False):
+        self.n_states = n_states
+        self.batch_size = batch_size
+        self.max_iter = max_iter
+        self.tol = tol
+        self.decay = decay
+        self.n_init = n_init
+        self.random_state = random_state
+        self.verbose = verbose
+        self.maps_ = None
+        self._scatter = None
+        self.n_steps_ = 0
+        self.n_samples_seen_ = 0
+        self.converged_ = False
+        self._shifts = deque(maxlen=10)
+
+    def _accumulate(self, X, labels):
+        """Decay the scatter matrices, then add those of every state's samples in X."""
+        self._scatter *= self.decay
+        for k in range(self.n_states):
+            Xk = X[labels == k]
+            self._scatter[k] += Xk.T @ Xk
+
+    def partial_fit(self, X):
+        """
+        Update the maps with one batch of samples.
+
+        Parameters:
+        -----------
+        X : array, shape (n_samples, n_channels)
+            Batch of (GFP peak) maps.
+
+        Returns:
+        --------
+        self
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if self.maps_ is None:
+            maps, labels, gev, _ = modified_kmeans(X, n_states=self.n_states, n_init=self.n_init,
+                                                   random_state=self.random_state)
+            self.maps_ = maps
+            self._scatter = np.zeros((self.n_states, X.shape[1], X.shape[1]))
+            self._accumulate(X, labels)
+            shift = None
+        else:
+            labels = np.argmax(np.abs(self.maps_ @ X.T), axis=0)
+            self._accumulate(X, labels)
+
+            # One power-iteration step: map_k <- S_k map_k
+            new_maps = np.einsum('kij,kj->ki', self._scatter, self.maps_)
+            norms = np.linalg.norm(new_maps, axis=1, keepdims=True)
+            new_maps = np.where(norms > 0, new_maps / np.maximum(norms, 1e-16), self.maps_)
+            shift = np.max(1 - np.abs(np.sum(new_maps * self.maps_, axis=1)))
+            self.maps_ = new_maps
+            if self.verbose:
+                print(f"Batch {self.n_steps_ + 1}: GEV={self.score(X):.4f}, map change={shift:.2e}")
+
+        self.n_steps_ += 1
+        self.n_samples_seen_ += len(X)
+        if shift is not None:
+            self._shifts.append(shift)
+        # A single batch can move the maps by chance little, so use the average
+        self.converged_ = (len(self._shifts) == self._shifts.maxlen
+                           and np.mean(self._shifts) <= self.tol)
+        return self
+
+    def fit(self, X):
+        """
+        Fit on all samples of X in random mini-batches of batch_size.
+
+        X may be a np.memmap; every batch is read with sorted indices.
+
+        Returns:
+        --------
+        self
+        """
+        n_samples = len(X)
+        rng = np.random.RandomState(self.random_state)
+        for _ in range(self.max_iter):
+            perm = rng.permutation(n_samples)
+            for start in range(0, n_samples, self.batch_size):
+                idx = np.sort(perm[start:start + self.batch_size])
+                if len(idx) < self.n_states:
+                    continue
+                self.partial_fit(X[idx])
+                if self.converged_:
+                    return self
+        return self
+
+    def predict(self, X):
+        """Cluster index (highest absolute correlation) of every sample."""
+        return np.argmax(np.abs(self.maps_ @ np.asarray(X).T), axis=0)
+
+    def score(self, X, chunk_size=100000):
+        """Global Explained Variance of the maps on X (as in modified_kmeans)."""
+        explained, gfp_sum_sq = 0.0, 0.0
+        for start in range(0, len(X), chunk_size):
+            x = np.asarray(X[start:start + chunk_size], dtype=np.float64)
+            gfp_sq = np.var(x, axis=1)
+            best_proj = np.max(np.abs(self.maps_ @ x.T), axis=0)
+            explained += np.sum(gfp_sq / (np.sum(x**2, axis=1) + 1e-16) * best_proj**2)
+            gfp_sum_sq += gfp_sq.sum()
+        return explained / gfp_sum_sq
+
+def _local_maxima(gfp):
     """
-    Perform Microstate Analysis using K-Means clustering.
+    Local maxima of every row of a GFP array, as found by
+    scipy.signal.find_peaks on each row.
+
+    A sample is a peak if it is higher than the sample before it and the
+    signal falls after it. A flat top counts once, at its middle (rounded
+    down). The first and last samples of a row are never peaks.
+
+    Parameters:
+    -----------
+    gfp : array, shape (n_rows, n_times)
+
+    Returns:
+    --------
+    rows, cols : arrays of int, shape (n_peaks,)
+        Row and sample index of each peak, in row-major order.
+    """
+    d = np.diff(gfp, axis=1)
+    rise = d[:, :-1] > 0
+    # Strict maxima: higher than both neighbours
+    rows, cols = np.nonzero(rise & (d[:, 1:] < 0))
+    cols += 1
+
+    # Flat tops: a rise into equal samples. The top is a peak if the next
+    # change in its row is a fall.
+    top_rows, top_starts = np.nonzero(rise & (d[:, 1:] == 0))
+    if len(top_rows):
+        top_starts += 1
+        n = d.shape[1]
+        # Walk all tops forward together to their last sample (d[row, end] != 0)
+        top_ends = top_starts.copy()
+        flat = np.arange(len(top_rows))
+        while len(flat):
+            top_ends[flat] += 1
+            flat = flat[top_ends[flat] < n]
+            flat = flat[d[top_rows[flat], top_ends[flat]] == 0]
+        # Tops running to the end of the row are not peaks
+        is_top = top_ends < n
+        is_top[is_top] = d[top_rows[is_top], top_ends[is_top]] < 0
+        rows = np.concatenate([rows, top_rows[is_top]])
+        cols = np.concatenate([cols, (top_starts + top_ends)[is_top] // 2])
+        order = np.lexsort((cols, rows))
+        rows, cols = rows[order], cols[order]
+    return rows, cols
+
+def extract_gfp_peaks_epochs(data, min_distance=None, min_gfp=None):
+    """
+    GFP peaks of every epoch, found within each epoch.
+
+    The GFP is computed one epoch at a time (no temporary the size of the
+    data). Peaks are then found on the whole (n_epochs, n_times) GFP array
+    at once, within each epoch, so no peak is ever placed at an epoch
+    boundary (unlike peak finding on concatenated epochs). They are the
+    local maxima `scipy.signal.find_peaks` finds on each epoch, as in
+    `extract_gfp_peaks_streaming` (a flat top counts once, at its middle).
+
+    Parameters:
+    -----------
+    data : array, shape (n_epochs, n_channels, n_times)
+        The EEG data (a 2D (n_channels, n_times) array is one epoch).
+    min_distance : int | None
+        Minimum number of samples between peaks: a peak is kept only if it is
+        the highest GFP within +-min_distance samples of its epoch.
+    min_gfp : float | None
+        Discard peaks with a GFP below this value.
+
+    Returns:
+    --------
+    peak_maps : array, shape (n_peaks, n_channels)
+        The data at the GFP peaks.
+    peak_epochs : array, shape (n_peaks,)
+        Epoch index of each peak.
+    peak_samples : array, shape (n_peaks,)
+        Sample index of each peak within its epoch.
+    gfp : array, shape (n_epochs, n_times)
+        The GFP of every epoch.
+    """
+    if data.ndim == 2:
+        data = data[np.newaxis]
+    gfp = np.empty((data.shape[0], data.shape[2]))
+    for e in range(data.shape[0]):
+        gfp[e] = calculate_gfp(data[e])
+    is_peak = np.zeros(gfp.shape, dtype=bool)
+    is_peak[_local_maxima(gfp)] = True
+
+    if min_gfp is not None:
+        is_peak &= gfp >= min_gfp
+    if min_distance is not None and min_distance > 0:
+        # Peak must be the maximum of its window (windows do not cross epochs)
+        local_max = maximum_filter1d(gfp, size=2 * int(min_distance) + 1, axis=1,
+                                     mode='constant', cval=-np.inf)
+        is_peak &= gfp >= local_max
+
+    peak_epochs, peak_samples = np.nonzero(is_peak)
+    # Fancy indexing over (epoch, sample) pairs gives (n_peaks, n_channels)
+    peak_maps = data[peak_epochs, :, peak_samples]
+    return peak_maps, peak_epochs, peak_samples, gfp
+
+def extract_gfp_peaks(inst, min_distance=None, min_gfp=None):
+    """
+    Get the data of an instance, its GFP and the maps at GFP peaks.
+
+    Epochs are not concatenated: peaks are found within each epoch by
+    `extract_gfp_peaks_epochs`.
+
+    Parameters:
+    -----------
+    inst : mne.io.Raw or mne.Epochs
+        Data object.
+    min_distance, min_gfp : int | None, float | None
+        Peak thresholds, see `extract_gfp_peaks_epochs`.
+
+    Returns:
+    --------
+    data : array, shape (n_channels, n_times) or (n_epochs, n_channels, n_times)
+        The data.
+    gfp : array, shape (n_times,) or (n_epochs, n_times)
+        The GFP time series.
+    peak_maps : array, shape (n_peaks, n_channels)
+        The data at GFP peaks (local maxima).
+    """
+    # Get data
+    if hasattr(inst, 'get_data'):
+        data = inst.get_data() # (n_channels, n_times) or (n_epochs, n_channels, n_times)
+    else:
+        raise ValueError("Instance must have get_data() method")
+
+    peak_maps, _, _, gfp = extract_gfp_peaks_epochs(data, min_distance=min_distance,
+                                                    min_gfp=min_gfp)
+    if data.ndim == 2:
+        gfp = gfp[0]
+
+    return data, gfp, peak_maps
+
+def extract_gfp_peaks_streaming(raw, block_size=100000, max_peaks=None, picks=None,
+                                random_state=None):
+    """
+    Extract maps at GFP peaks from a Raw object block by block.
+
+    Only `block_size` samples are read at a time (works on non-preloaded
+    mne.io.Raw), and only the peak maps are kept. The end of each block is
+    carried into the next one: its last sample, or, if the GFP ends on a
+    rise into a flat top, the top and the sample before it. Peaks at block
+    boundaries, including flat tops spanning them, are therefore those of
+    `scipy.signal.find_peaks` on the GFP of the whole recording.
+
+    Parameters:
+    -----------
+    raw : mne.io.Raw
+        Continuous data, preloaded or not.
+    block_size : int
+        Number of samples read at a time.
+    max_peaks : int | None
+        If given, keep a uniform random subsample of at most this many peaks
+        (reservoir sampling), so memory does not grow with recording length.
+    picks : str | list | None
+        Channels to use, passed to raw.get_data().
+    random_state : int | None
+        Seed for the subsampling.
+
+    Returns:
+    --------
+    peak_maps : array, shape (n_peaks, n_channels)
+        The data at the (kept) GFP peaks.
+    peak_samples : array, shape (n_peaks,)
+        Sample index of each kept peak.
+    n_peaks_total : int
+        Number of GFP peaks in the recording before subsampling.
+    """
+    n_times = raw.n_times
+    rng = np.random.RandomState(random_state)
+
+    maps_list, samples_list = [], []
+    reservoir, reservoir_samples = None, None
+    n_seen = 0
+
+    carry, carry_start = None, 0
+    for start in range(0, n_times, block_size):
+        stop = min(start + block_size, n_times)
+        block = raw.get_data(picks=picks, start=start, stop=stop)
+        r0 = start
+        if carry is not None:
+            block = np.concatenate([carry, block], axis=1)
+            r0 = carry_start
+
+        gfp = calculate_gfp(block)
+        _, peaks = _local_maxima(gfp[np.newaxis])
+        block_maps = block[:, peaks].T
+        block_samples = peaks + r0
+
+        # Carry the samples whose peak status depends on the next block: the
+        # last sample, or the sample before a flat top still open at the end
+        changes = np.flatnonzero(np.diff(gfp))
+        keep = len(gfp) - 1
+        if len(changes) and gfp[changes[-1] + 1] > gfp[changes[-1]]:
+            keep = changes[-1]
+        carry, carry_start = block[:, keep:].copy(), r0 + keep
+
+        if max_peaks is None:
+            maps_list.append(block_maps)
+            samples_list.append(block_samples)
+            n_seen += len(peaks)
+            continue
+
+        if reservoir is None:
+            reservoir = np.empty((max_peaks, block.shape[0]), dtype=block.dtype)
+            reservoir_samples = np.empty(max_peaks, dtype=np.intp)
+
+        # Reservoir sampling (Algorithm R): fill first, then replace slot j
+        # with probability max_peaks / (i + 1)
+        idx = n_seen + np.arange(len(peaks))
+        fill = idx < max_peaks
+        reservoir[idx[fill]] = block_maps[fill]
+        reservoir_samples[idx[fill]] = block_samples[fill]
+
+        j = (rng.random_sample((~fill).sum()) * (idx[~fill] + 1)).astype(np.intp)
+        keep = j < max_peaks
+        # Later peaks overwrite earlier ones on duplicate slots, as sequentially
+        reservoir[j[keep]] = block_maps[~fill][keep]
+        reservoir_samples[j[keep]] = block_samples[~fill][keep]
+        n_seen += len(peaks)
+
+    if max_peaks is None:
+        n_ch = maps_list[0].shape[1] if maps_list else 0
+        peak_maps = np.concatenate(maps_list) if maps_list else np.zeros((0, n_ch))
+        peak_samples = np.concatenate(samples_list) if samples_list else np.zeros(0, dtype=np.intp)
+    else:
+        n_kept = min(n_seen, max_peaks)
+        order = np.argsort(reservoir_samples[:n_kept])
+        peak_maps = reservoir[:n_kept][order]
+        peak_samples = reservoir_samples[:n_kept][order]
+
+    return peak_maps, peak_samples, n_seen
+
+def backfit(data, maps, chunk_size=100000, dtype=np.float64, picks=None):
+    """
+    Assign every time point to the best-correlated microstate map.
+
+    The data is processed in time chunks of `chunk_size` samples, so the
+    temporaries are bounded by the chunk size (the data itself may be a
+    np.memmap, or a non-preloaded Raw read chunk by chunk). Epoched data is
+    processed in chunks of whole epochs, without concatenating all epochs.
+
+    Parameters:
+    -----------
+    data : array, shape (n_channels, n_times) or (n_epochs, n_channels, n_times) | mne.io.Raw
+        The EEG data.
+    maps : array, shape (n_states, n_channels)
+        Unit-norm microstate maps.
+    chunk_size : int
+        Number of samples per chunk.
+    dtype : numpy dtype
+        Computation and output dtype of the correlations (np.float32 halves
+        memory).
+    picks : str | list | None
+        Channels to use when `data` is a Raw.
+
+    Returns:
+    --------
+    labels : array, shape (n_times,)
+        Label of the best map at each time point (for epochs, n_times is
+        n_epochs * n_times_per_epoch, epochs in order).
+    corr : array, shape (n_times,)
+        Absolute correlation with that map (polarity is ignored).
+    state_gev : array, shape (n_states,)
+        Global Explained Variance contributed by each state, i.e.
+        sum over its samples of (GFP * corr)^2 / sum(GFP^2). The total GEV is
+        state_gev.sum().
+    """
+    is_raw = hasattr(data, 'get_data')
+    is_epochs = not is_raw and np.ndim(data) == 3
+    if is_raw:
+        n_times = data.n_times
+    elif is_epochs:
+        n_epochs, n_ch, n_epoch_times = data.shape
+        n_times = n_epochs * n_epoch_times
+        # Whole epochs per chunk
+        chunk_size = max(1, chunk_size // n_epoch_times) * n_epoch_times
+    else:
+        n_times = data.shape[1]
+    n_states = len(maps)
+    maps = np.asarray(maps, dtype=dtype)
+
+    labels = np.empty(n_times, dtype=np.intp)
+    corr = np.empty(n_times, dtype=dtype)
+    explained = np.zeros(n_states)
+    gfp_sum_sq = 0.0
+
+    for start in range(0, n_times, chunk_size):
+        stop = min(start + chunk_size, n_times)
+        if is_raw:
+            x = data.get_data(picks=picks, start=start, stop=stop).astype(dtype, copy=False)
+        elif is_epochs:
+            # (n_chunk_epochs, n_ch, n_epoch_times) -> (n_ch, n_chunk_epochs * n_epoch_times)
+            block = data[start // n_epoch_times:stop // n_epoch_times]
+            x = np.asarray(block, dtype=dtype).transpose(1, 0, 2).reshape(n_ch, -1)
+        else:
+            x = np.asarray(data[:, start:stop], dtype=dtype)
+
+        # Correlation is the dot product of normalized vectors; take the
+        # absolute value because polarity doesn't matter
+        activation = np.abs(maps @ x)
+        activation /= np.linalg.norm(x, axis=0) + 1e-16
+
+        lab = np.argmax(activation, axis=0)
+        c = np.take_along_axis(activation, lab[np.newaxis], axis=0)[0]
+        labels[start:stop] = lab
+        corr[start:stop] = c
+
+        # GEV = sum( (GFP * corr)^2 ) / sum( GFP^2 )
+        gfp = calculate_gfp(x)
+        explained += np.bincount(lab, weights=(gfp * c)**2, minlength=n_states)
+        gfp_sum_sq += np.sum(gfp.astype(np.float64)**2)
+
+    state_gev = explained / gfp_sum_sq
+
+    return labels, corr, state_gev
+
+def segment_microstates(inst, n_states=4, random_state=None, n_init=10,
+                        method='modified', max_iter=300, tol=1e-6, verbose=False,
+                        block_size=None, max_peaks=None, batch_size=4096,
+                        min_peak_distance=None, min_gfp=None):
+    """
+    Perform Microstate Analysis using (modified) K-Means clustering.
 
     Parameters:
     -----------
@@ -37,9 +625,31 @@ def segment_microstates(inst, n_states=4, random_state=None, n_init=10):
     n_states : int
         Number of microstates to find (default 4).
     random_state : int | None
-        Seed for KMeans.
+        Seed for the clustering.
     n_init : int
-        Number of initializations for KMeans.
+        Number of initializations for the clustering.
+    method : 'modified' | 'minibatch' | 'kmeans'
+        'modified' uses the polarity-invariant `modified_kmeans` on the GFP
+        peak maps. 'minibatch' uses `MiniBatchModifiedKMeans` (for millions
+        of peaks). 'kmeans' is the previous sklearn KMeans on unit-norm peak
+        maps (requires scikit-learn).
+    max_iter, tol : int, float
+        Iteration limit and GEV convergence tolerance of `modified_kmeans`
+        (for 'minibatch': passes over the peaks and running map-change tolerance).
+    verbose : bool
+        Print per-iteration GEV and timing of `modified_kmeans`.
+    block_size : int | None
+        For Raw input, read the data in blocks of this many samples
+        (`extract_gfp_peaks_streaming` and chunked `backfit`) instead of
+        loading it all, so non-preloaded recordings can be segmented.
+    max_peaks : int | None
+        With `block_size`, cluster a random subsample of at most this many
+        GFP peaks.
+    batch_size : int
+        Mini-batch size for method='minibatch'.
+    min_peak_distance, min_gfp : int | None, float | None
+        Thresholds that reduce the number of GFP peaks (see
+        `extract_gfp_peaks_epochs`). Ignored with `block_size`.
 
     Returns:
     --------
@@ -51,233 +661,629 @@ def segment_microstates(inst, n_states=4, random_state=None, n_init=10):
         Global Explained Variance.
     """
 
-    # 1. Get data
-    if hasattr(inst, 'get_data'):
-        data = inst.get_data() # (n_channels, n_times) or (n_epochs, n_channels, n_times)
+    # 1-3. Data, GFP and maps at GFP peaks
+    streaming = block_size is not None and hasattr(inst, 'n_times')
+    if streaming:
+        data = inst
+        peak_maps, _, _ = extract_gfp_peaks_streaming(inst, block_size=block_size,
+                                                      max_peaks=max_peaks,
+                                                      random_state=random_state)
     else:
-        raise ValueError("Instance must have get_data() method")
-
-    # If epochs, concatenate trials for clustering?
-    if data.ndim == 3:
-        n_epochs, n_ch, n_times = data.shape
-        data = np.hstack(data) # (n_ch, n_epochs * n_times)
-
-    n_ch, n_times = data.shape
-
-    # 2. Compute GFP
-    gfp = calculate_gfp(data)
-
-    # 3. Find GFP peaks (local maxima)
-    # Simple peak finding
-    peaks, _ = find_peaks(gfp)
-
-    # Extract maps at peaks
-    peak_maps = data[:, peaks].T # (n_peaks, n_channels)
-
-    # Normalize maps at peaks (ignore polarity)?
-    # Usually for microstates, polarity doesn't matter (map and -map are same state).
-    # But standard K-means cares.
-    # A common approach is to cluster [Map, -Map] or ensure polarity alignment.
-    # Modified K-Means for microstates usually ignores polarity.
-    # Since we are using sklearn KMeans, we can't easily change the distance metric to ignore polarity.
-    # A simplified approach: Use standard KMeans. This is "Topographic Atomize and Agglomerate Hierarchical Clustering" (TAAHC)
-    # or similar often used, but K-Means is also standard (e.g., Pascual-Marqui et al., 1995).
-    # To handle polarity in standard KMeans, one might align all maps to have positive correlation with the first component?
-    # Or just run KMeans on the raw vectors and accept that State A and -State A might be separate clusters if we are unlucky?
-    # Actually, the standard "Modified K-Means" flips the sign of the data vector to match the cluster center.
-
-    # For this implementation, we will stick to standard K-Means for simplicity
-    # but we will normalize the peak maps to have unit norm.
-    # Note: Standard Microstate analysis uses "Modified K-Means" which ignores polarity
-    # (treats map X and -X as same). This implementation uses standard K-Means, which
-    # is a simplification. Polarity is handled in the backfitting step (absolute correlation).
-    peak_maps_norm = peak_maps / np.linalg.norm(peak_maps, axis=1, keepdims=True)
+        data, _, peak_maps = extract_gfp_peaks(inst, min_distance=min_peak_distance,
+                                               min_gfp=min_gfp)
 
     # 4. Clustering
-    # We use sklearn KMeans
-    kmeans = KMeans(n_clusters=n_states, random_state=random_state, n_init=n_init)
-    kmeans.fit(peak_maps_norm)
+    if method == 'modified':
+        # Modified K-means treats map X and -X as the same state and weights
+        # every peak by its GFP (maps are not normalized beforehand)
+        maps, _, _, _ = modified_kmeans(peak_maps, n_states=n_states, n_init=n_init,
+                                        max_iter=max_iter, tol=tol,
+                                        random_state=random_state, verbose=verbose)
+    elif method == 'minibatch':
+        # max_iter passes over the peaks at most; tol applies to the map change
+        mbk = MiniBatchModifiedKMeans(n_states=n_states, batch_size=batch_size,
+                                      max_iter=max_iter, tol=tol, n_init=n_init,
+                                      random_state=random_state, verbose=verbose)
+        maps = mbk.fit(peak_maps).maps_
+    elif method == 'kmeans':
+        from sklearn.cluster import KMeans
+
+        # Standard K-means does not ignore polarity, so State A and -State A may
+        # end up as separate clusters. Polarity is only handled in the
+        # backfitting step (absolute correlation).
+        peak_maps_norm = peak_maps / np.linalg.norm(peak_maps, axis=1, keepdims=True)
+        kmeans = KMeans(n_clusters=n_states, random_state=random_state, n_init=n_init)
+        kmeans.fit(peak_maps_norm)
+        maps = kmeans.cluster_centers_ # (n_states, n_channels)
+    else:
+        raise ValueError(f"Unknown method: {method}")
 
-    maps = kmeans.cluster_centers_ # (n_states, n_channels)
     # Normalize result maps
     maps = maps / np.linalg.norm(maps, axis=1, keepdims=True)
 
-    # 5. Backfitting
-    # Assign every time point to the closest map (correlation)
-    # Correlation is dot product of normalized vectors
+    # 5. Backfitting and Global Explained Variance
+    segmentation, _, state_gev = backfit(data, maps, chunk_size=block_size or 100000)
+    gev = state_gev.sum()
 
-    # Normalize data
-    data_norm = data / (np.linalg.norm(data, axis=0, keepdims=True) + 1e-16)
+    # Sort states by GEV contribution (descending)
+    sort_idx = np.argsort(state_gev)[::-1]
+    maps = maps[sort_idx]
 
-    # Compute correlation with all state maps: (n_states, n_channels) @ (n_channels, n_times) -> (n_states, n_times)
-    activation = maps @ data_norm
+    # Re-map segmentation labels with the inverse permutation
+    rank = np.empty(n_states, dtype=segmentation.dtype)
+    rank[sort_idx] = np.arange(n_states)
+    segmentation = rank[segmentation]
 
-    # Take absolute correlation because polarity doesn't matter
-    activation = np.abs(activation)
+    return maps, segmentation, gev
 
-    # Assign label
-    segmentation = np.argmax(activation, axis=0)
+# Peak matrix attached from shared memory in fit_microstate_range workers
+_shared_peaks = None
 
-    # 6. Global Explained Variance
-    # GEV = sum( (GFP * corr)^2 ) / sum( GFP^2 )
-    # corr is the correlation of the assigned map with the data
+def _attach_shared_peaks(name, shape, dtype):
+    """Pool initializer: map the parent's peak matrix without copying it."""
+    global _shared_peaks
+    shm = shared_memory.SharedMemory(name=name)
+    _shared_peaks = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
 
-    gfp_sum_sq = np.sum(gfp**2)
-    max_corr = np.max(activation, axis=0) # Correlation of best matching map
-    gev = np.sum( (gfp * max_corr)**2 ) / gfp_sum_sq
+def _fit_n_states(n_states, n_init, max_iter, tol, random_state, peak_maps=None):
+    """Fit one model and compute its GEV and cross-validation criterion."""
+    if peak_maps is None:
+        peak_maps = _shared_peaks[1]
 
-    # Sort states by occurrence or GEV contribution?
-    # Let's sort by GEV contribution of each state
-    state_gev = []
-    for k in range(n_states):
-        mask = (segmentation == k)
-        gfp_k = gfp[mask]
-        corr_k = max_corr[mask]
-        gev_k = np.sum((gfp_k * corr_k)**2) / gfp_sum_sq
-        state_gev.append(gev_k)
+    maps, labels, gev, _ = modified_kmeans(peak_maps, n_states=n_states, n_init=n_init,
+                                           max_iter=max_iter, tol=tol,
+                                           random_state=random_state)
 
-    sort_idx = np.argsort(state_gev)[::-1] # Descending
+    # Cross-validation criterion (Pascual-Marqui et al., 1995): residual
+    # variance corrected for the degrees of freedom of the model
+    n_peaks, n_ch = peak_maps.shape
+    proj = np.einsum('ij,ij->i', peak_maps, maps[labels])
+    sigma_sq = (np.sum(peak_maps**2) - np.sum(proj**2)) / (n_peaks * (n_ch - 1))
+    cv = sigma_sq * ((n_ch - 1) / (n_ch - 1 - n_states))**2
 
-    maps = maps[sort_idx]
+    return maps, gev, cv
 
-    # Re-map segmentation labels
-    remap = {old: new for new, old in enumerate(sort_idx)}
-    segmentation = np.array([remap[s] for s in segmentation])
+def fit_microstate_range(inst, n_states_range=range(2, 16), random_state=None, n_init=10,
+                         max_iter=300, tol=1e-6, n_jobs=1):
+    """
+    Fit microstate models for several numbers of states, for model selection.
 
-    return maps, segmentation, gev
+    The data, GFP and GFP peak maps are computed once. With n_jobs > 1 the
+    models are fitted in a process pool; the peak matrix is placed in shared
+    memory so workers read it without pickling.
+
+    Parameters:
+    -----------
+    inst : mne.io.Raw or mne.Epochs
+        Data object.
+    n_states_range : iterable of int
+        Numbers of states to fit (default 2..15).
+    random_state : int | None
+        Seed for the clustering (same seed for every n_states).
+    n_init, max_iter, tol :
+        Passed to `modified_kmeans`.
+    n_jobs : int
+        Number of worker processes (-1 or any value <= 0 uses all CPUs,
+        capped at the number of models).
 
-def smooth_segmentation(segmentation, min_duration=0):
+    Returns:
+    --------
+    results : dict
+        'n_states' : array of the fitted numbers of states.
+        'gev' : array, GEV on the GFP peaks per model.
+        'cv' : array, cross-validation criterion per model (lower is better).
+        'maps' : list of arrays (n_states, n_channels), sorted like 'n_states'.
+    """
+    n_states_range = [int(k) for k in n_states_range]
+    _, _, peak_maps = extract_gfp_peaks(inst)
+    n_ch = peak_maps.shape[1]
+    if max(n_states_range) >= n_ch - 1:
+        raise ValueError(f"n_states must be smaller than n_channels - 1 ({n_ch - 1})")
+
+    fit_args = (n_init, max_iter, tol, random_state)
+
+    if n_jobs is None or n_jobs <= 0:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = min(n_jobs, len(n_states_range))
+
+    if n_jobs == 1:
+        fits = [_fit_n_states(k, *fit_args, peak_maps=peak_maps) for k in n_states_range]
+    else:
+        peak_maps = np.ascontiguousarray(peak_maps)
+        shm = shared_memory.SharedMemory(create=True, size=peak_maps.nbytes)
+        try:
+            np.ndarray(peak_maps.shape, dtype=peak_maps.dtype, buffer=shm.buf)[:] = peak_maps
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_attach_shared_peaks,
+                                     initargs=(shm.name, peak_maps.shape, peak_maps.dtype)) as pool:
+                futures = [pool.submit(_fit_n_states, k, *fit_args) for k in n_states_range]
+                fits = [f.result() for f in futures]
+        finally:
+            shm.close()
+            shm.unlink()
+
+    results = {
+        'n_states': np.array(n_states_range),
+        'gev': np.array([gev for _, gev, _ in fits]),
+        'cv': np.array([cv for _, _, cv in fits]),
+        'maps': [maps for maps, _, _ in fits],
+    }
+
+    return results
+
+def run_length_encode(segmentation):
+    """
+    Run-length encode a label sequence.
+
+    Parameters:
+    -----------
+    segmentation : array, shape (n_times,)
+        Label sequence.
+
+    Returns:
+    --------
+    values : array, shape (n_segments,)
+        Label of each segment.
+    starts : array, shape (n_segments,)
+        First sample of each segment.
+    lengths : array, shape (n_segments,)
+        Number of samples in each segment.
+    """
+    segmentation = np.asarray(segmentation)
+    n_samples = len(segmentation)
+    if n_samples == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return segmentation[:0], empty, empty
+
+    starts = np.flatnonzero(np.r_[True, segmentation[1:] != segmentation[:-1]])
+    lengths = np.diff(np.r_[starts, n_samples])
+    return segmentation[starts], starts, lengths
+
+def _segment_correlation(data, maps, labels, starts, lengths):
+    """Sum over each segment of |corr(data(t), maps[label])|."""
+    # Sample indices of all segments, concatenated
+    offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+    idx = np.arange(lengths.sum()) - np.repeat(offsets - starts, lengths)
+
+    x = data[:, idx]
+    corr = np.einsum('ij,ji->i', maps[np.repeat(labels, lengths)], x)
+    corr = np.abs(corr) / (np.linalg.norm(x, axis=0) + 1e-16)
+    return np.add.reduceat(corr, offsets)
+
+def smooth_segmentation(segmentation, min_duration=0, data=None, maps=None, max_iter=100):
     """
     Smooth microstate segmentation by rejecting short segments.
 
+    Works on the run-length encoding of the sequence and repeats vectorized
+    passes until no segment is shorter than `min_duration` (merging can
+    leave new short segments, which the next pass removes). In each pass,
+    every other segment of a chain of consecutive short segments is
+    reassigned, so neighbouring short segments never compete for each other.
+
     Parameters:
     -----------
     segmentation : array
         The label sequence.
     min_duration : int
         Minimum number of samples for a segment.
+    data : array, shape (n_channels, n_times) | None
+        The data the segmentation was computed from. If given together with
+        `maps`, a short segment is merged into the neighbour whose map
+        correlates best with the data over the segment. Otherwise it is split
+        in half between its left and right neighbours.
+    maps : array, shape (n_states, n_channels) | None
+        The (unit-norm) microstate maps.
+    max_iter : int
+        Maximum number of passes.
 
     Returns:
     --------
     smoothed : array
         Smoothed label sequence.
     """
+    smoothed = np.asarray(segmentation).copy()
     if min_duration <= 1:
-        return segmentation.copy()
-
-    # Find segments
-    # Simple smoothing: if segment < min_duration, assign to neighbor?
-    # Standard approach: check bounds and merge into previous or next segment based on correlation
-    # For simplicity here: merge into previous segment (or next if it's the start).
-
-    smoothed = segmentation.copy()
-    n_samples = len(smoothed)
-
-    # Identify run lengths
-    # Using simple iteration
-
-    # This loop might be slow for very long data, but adequate for typical EEG
-    # A cleaner way: find indices where value changes
-    change_points = np.where(np.diff(smoothed) != 0)[0] + 1
-    # Add start and end
-    change_points = np.concatenate(([0], change_points, [n_samples]))
-
-    for i in range(len(change_points)-1):
-        start = change_points[i]
-        end = change_points[i+1]
-        length = end - start
-
-        if length < min_duration:
-            # Segment too short. Reassign.
-            # Assign to the 'half' that matches left and 'half' that matches right?
-            # Or usually: assign to the neighbor that has the highest correlation (if we had access to data here).
-            # Without data access in this function, we usually assign to the *middle* of the neighbors
-            # or simply to the previous one (causal).
-
-            # Simple heuristic: Split and assign half to left, half to right.
-
-            left_neighbor = smoothed[start-1] if start > 0 else smoothed[end]
-            right_neighbor = smoothed[end] if end < n_samples else smoothed[start-1]
-
-            # If at very start, assign to right
-            if start == 0:
-                smoothed[start:end] = right_neighbor
-            elif end == n_samples:
-                smoothed[start:end] = left_neighbor
-            else:
-                # Split
-                mid = start + length // 2
-                smoothed[start:mid] = left_neighbor
-                smoothed[mid:end] = right_neighbor
+        return smoothed
+
+    use_data = data is not None and maps is not None
+
+    for _ in range(max_iter):
+        values, starts, lengths = run_length_encode(smoothed)
+        n_segments = len(values)
+
+        short = lengths < min_duration
+        if n_segments < 2 or not short.any():
+            break
+
+        # Position of each short segment within its chain of short segments
+        seg_idx = np.arange(n_segments)
+        chain_start = short & ~np.r_[False, short[:-1]]
+        pos = seg_idx - np.maximum.accumulate(np.where(chain_start, seg_idx, 0))
+        sel = np.flatnonzero(short & (pos % 2 == 0))
 
-    # Run again? Merging might create new short segments.
-    # Usually smoothing is run iteratively until convergence or just once.
-    # We'll run it once for simplicity.
+        has_left = sel > 0
+        has_right = sel < n_segments - 1
+        left = np.where(has_left, values[np.maximum(sel - 1, 0)], -1)
+        right = np.where(has_right, values[np.minimum(sel + 1, n_segments - 1)], -1)
+
+        # Each segment becomes two pieces: [start, start + n_left) and the rest
+        piece_len = np.stack([lengths, np.zeros_like(lengths)], axis=1)
+        piece_val = np.stack([values, values], axis=1)
+
+        if use_data:
+            # Whole segment goes to the best-correlated neighbour
+            both = has_left & has_right
+            to_left = ~has_right
+            if both.any():
+                corr_left = _segment_correlation(data, maps, left[both], starts[sel[both]], lengths[sel[both]])
+                corr_right = _segment_correlation(data, maps, right[both], starts[sel[both]], lengths[sel[both]])
+                to_left[both] = corr_left >= corr_right
+            n_left = np.where(to_left, lengths[sel], 0)
+        else:
+            # Split: first half to the left neighbour, second half to the right
+            n_left = np.where(has_left, lengths[sel] // 2, 0)
+            n_left = np.where(has_right, n_left, lengths[sel])
+
+        piece_len[sel, 0] = n_left
+        piece_len[sel, 1] = lengths[sel] - n_left
+        piece_val[sel, 0] = left
+        piece_val[sel, 1] = right
+
+        smoothed = np.repeat(piece_val.ravel(), piece_len.ravel()).astype(smoothed.dtype)
 
     return smoothed
 
-def calculate_statistics(segmentation, sfreq=None, n_states=4):
+def calculate_statistics(segmentation, sfreq=None, n_states=4, gfp=None, corr=None):
     """
     Calculate microstate statistics.
 
+    All statistics come from a single run-length encoding pass. Several
+    subjects can be processed at once by passing a list of label sequences
+    (of possibly different lengths) or a 2D array (n_subjects, n_times).
+
     Parameters:
     -----------
-    segmentation : array
-        Label sequence.
+    segmentation : array | list of arrays | array, shape (n_subjects, n_times)
+        Label sequence(s).
     sfreq : float | None
         Sampling frequency. If None, duration is in samples.
     n_states : int
         Number of states.
+    gfp : array | list of arrays | None
+        GFP at every sample, same layout as `segmentation`.
+    corr : array | list of arrays | None
+        Absolute correlation of every sample with its assigned map (as
+        returned by backfitting). With `gfp`, enables the per-state GEV.
 
     Returns:
     --------
     stats : dict
-        Dictionary containing 'duration', 'occurrence', 'coverage'.
+        Dictionary containing 'duration', 'occurrence', 'coverage' (n_states,),
+        'transition' (n_states, n_states): probability that a segment of
+        state i is followed by one of state j, and 'gev' (n_states,) if
+        `gfp` and `corr` are given.
+        For several subjects every entry has a leading n_subjects axis, and
+        'table' holds a tidy structured array with one row per
+        (subject, state).
     """
+    group = isinstance(segmentation, (list, tuple)) or np.ndim(segmentation) == 2
+    if group:
+        segmentations = [np.asarray(seg) for seg in segmentation]
+    else:
+        segmentations = [np.asarray(segmentation)]
+    n_subjects = len(segmentations)
+    with_gev = gfp is not None and corr is not None
 
-    stats = {
-        'duration': np.zeros(n_states),    # Mean duration
-        'occurrence': np.zeros(n_states),  # Occurrences per second
-        'coverage': np.zeros(n_states)     # Fraction of time
-    }
+    # Concatenate subjects, segments never span a subject boundary
+    n_times = np.array([len(seg) for seg in segmentations])
+    labels = np.concatenate(segmentations)
+    subject = np.repeat(np.arange(n_subjects), n_times)
+    new_subject = np.zeros(len(labels), dtype=bool)
+    new_subject[np.cumsum(n_times)[:-1]] = True
+
+    is_start = new_subject
+    is_start[:1] = True
+    is_start[1:] |= labels[1:] != labels[:-1]
+    starts = np.flatnonzero(is_start)
+    lengths = np.diff(np.r_[starts, len(labels)])
+    seg_label = labels[starts]
+    seg_subject = subject[starts]
 
-    # Calculate coverage
-    total_time = len(segmentation)
+    # Only labels in [0, n_states) are counted (time still counts in the total)
+    valid = (seg_label >= 0) & (seg_label < n_states)
+    flat = seg_subject[valid] * n_states + seg_label[valid]
+    size = n_subjects * n_states
+
+    n_segments = np.bincount(flat, minlength=size).reshape(n_subjects, n_states)
+    n_samples = np.bincount(flat, weights=lengths[valid], minlength=size).reshape(n_subjects, n_states)
+
+    total_time = n_times[:, np.newaxis].astype(float)
+    coverage = n_samples / np.maximum(total_time, 1)
+
+    duration = n_samples / np.maximum(n_segments, 1) # in samples
     if sfreq:
-        total_seconds = total_time / sfreq
+        duration = duration * 1000.0 / sfreq # in ms
+        occurrence = n_segments / np.maximum(total_time / sfreq, 1e-16)
     else:
-        total_seconds = 1.0 # Normalized
+        occurrence = np.zeros((n_subjects, n_states))
+
+    # Transitions between consecutive segments of the same subject
+    same = (seg_subject[1:] == seg_subject[:-1]) & valid[1:] & valid[:-1]
+    pair = (seg_subject[1:][same] * n_states + seg_label[:-1][same]) * n_states + seg_label[1:][same]
+    counts = np.bincount(pair, minlength=size * n_states).reshape(n_subjects, n_states, n_states)
+    out_counts = counts.sum(axis=2, keepdims=True)
+    transition = counts / np.maximum(out_counts, 1)
 
-    for k in range(n_states):
-        count = np.sum(segmentation == k)
-        stats['coverage'][k] = count / total_time
+    stats = {
+        'duration': duration,      # Mean duration
+        'occurrence': occurrence,  # Occurrences per second
+        'coverage': coverage,      # Fraction of time
+        'transition': transition,  # Transition probabilities
+    }
+
+    if with_gev:
+        gfp_all = np.concatenate([np.asarray(g) for g in gfp]) if group else np.asarray(gfp)
+        corr_all = np.concatenate([np.asarray(c) for c in corr]) if group else np.asarray(corr)
+
+        sample_valid = (labels >= 0) & (labels < n_states)
+        flat_samples = subject[sample_valid] * n_states + labels[sample_valid]
+        explained = np.bincount(flat_samples, weights=(gfp_all * corr_all)[sample_valid]**2,
+                                minlength=size).reshape(n_subjects, n_states)
+        gfp_sum_sq = np.bincount(subject, weights=gfp_all**2, minlength=n_subjects)
+        stats['gev'] = explained / np.maximum(gfp_sum_sq, 1e-16)[:, np.newaxis]
+
+    if not group:
+        return {key: value[0] for key, value in stats.items()}
+
+    # Tidy table: one row per (subject, state)
+    fields = ['duration', 'occurrence', 'coverage'] + (['gev'] if with_gev else [])
+    table = np.zeros(size, dtype=[('subject', int), ('state', int)] + [(f, float) for f in fields])
+    table['subject'] = np.repeat(np.arange(n_subjects), n_states)
+    table['state'] = np.tile(np.arange(n_states), n_subjects)
+    for f in fields:
+        table[f] = stats[f].ravel()
+    stats['table'] = table
+
+    return stats
 
-    # Calculate duration and occurrence
-    # Find segments
-    change_points = np.where(np.diff(segmentation) != 0)[0] + 1
-    change_points = np.concatenate(([0], change_points, [total_time]))
+class StreamingStatistics:
+    """
+    Microstate statistics of one long label sequence, accumulated block by
+    block.
 
-    durations = [[] for _ in range(n_states)]
+    update() takes consecutive blocks of labels; the run open at the end of
+    a block is carried into the next one, so segments spanning block
+    boundaries are counted once. Only per-state counters are kept, so
+    memory does not grow with the recording length. result() gives the
+    same values as `calculate_statistics` on the whole sequence.
 
-    for i in range(len(change_points)-1):
-        start = change_points[i]
-        end = change_points[i+1]
-        length = end - start
-        label = segmentation[start]
+    Parameters:
+    -----------
+    n_states : int
+        Number of states.
+    sfreq : float | None
+        Sampling frequency. If None, duration is in samples.
+    """
 
-        if label < n_states:
-            if sfreq:
-                durations[label].append(length * 1000.0 / sfreq) # in ms
+    def __init__(self, n_states=4, sfreq=None):
+        self.n_states = n_states
+        self.sfreq = sfreq
+        self.n_times = 0
+        self.n_segments = np.zeros(n_states)
+        self.n_samples = np.zeros(n_states)
+        self.counts = np.zeros((n_states, n_states))
+        self.explained = np.zeros(n_states)
+        self.gfp_sum_sq = 0.0
+        # Label and length of the run still open at the end of the last
+        # block, and label of the last closed segment (-1 if none)
+        self._open_label = None
+        self._open_length = 0
+        self._prev_label = -1
+
+    def _valid(self, labels):
+        return (labels >= 0) & (labels < self.n_states)
+
+    def _close(self, values, lengths):
+        """Count closed segments and the transitions leading into them."""
+        valid = self._valid(values)
+        self.n_segments += np.bincount(values[valid], minlength=self.n_states)
+        self.n_samples += np.bincount(values[valid], weights=lengths[valid],
+                                      minlength=self.n_states)
+        seq = np.r_[self._prev_label, values]
+        same = self._valid(seq[1:]) & self._valid(seq[:-1])
+        np.add.at(self.counts, (seq[:-1][same], seq[1:][same]), 1)
+        self._prev_label = values[-1]
+
+    def update(self, labels, gfp=None, corr=None):
+        """
+        Add the next block of the label sequence.
+
+        Parameters:
+        -----------
+        labels : array, shape (n_block,)
+            Labels of the block.
+        gfp, corr : array, shape (n_block,) | None
+            GFP and absolute correlation with the assigned map of every
+            sample, for the per-state GEV (pass both in every block).
+        """
+        labels = np.asarray(labels)
+        if len(labels) == 0:
+            return
+        values, _, lengths = run_length_encode(labels)
+        values, lengths = values.astype(np.intp), lengths.astype(float)
+        if self._open_label is not None:
+            if values[0] == self._open_label:
+                lengths[0] += self._open_length
             else:
-                durations[label].append(length) # in samples
+                self._close(np.array([self._open_label]), np.array([float(self._open_length)]))
+        if len(values) > 1:
+            self._close(values[:-1], lengths[:-1])
+        self._open_label, self._open_length = values[-1], lengths[-1]
+        self.n_times += len(labels)
 
-    for k in range(n_states):
-        if len(durations[k]) > 0:
-            stats['duration'][k] = np.mean(durations[k])
-            if sfreq:
-                stats['occurrence'][k] = len(durations[k]) / total_seconds
+        if gfp is not None and corr is not None:
+            gfp = np.asarray(gfp, dtype=float)
+            valid = self._valid(labels)
+            self.explained += np.bincount(labels[valid].astype(np.intp),
+                                          weights=(gfp * np.asarray(corr))[valid]**2,
+                                          minlength=self.n_states)
+            self.gfp_sum_sq += np.sum(gfp**2)
+
+    def result(self):
+        """
+        Statistics of all blocks so far (the open run counts as a segment).
+
+        Returns:
+        --------
+        stats : dict
+            'duration', 'occurrence', 'coverage' (n_states,), 'transition'
+            (n_states, n_states) and 'gev' (n_states,) if GFP and
+            correlations were given, as in `calculate_statistics`.
+        """
+        n_segments, n_samples = self.n_segments.copy(), self.n_samples.copy()
+        counts = self.counts.copy()
+        label = self._open_label
+        if label is not None and 0 <= label < self.n_states:
+            n_segments[label] += 1
+            n_samples[label] += self._open_length
+            if 0 <= self._prev_label < self.n_states:
+                counts[self._prev_label, label] += 1
+
+        coverage = n_samples / max(self.n_times, 1)
+        duration = n_samples / np.maximum(n_segments, 1) # in samples
+        if self.sfreq:
+            duration = duration * 1000.0 / self.sfreq # in ms
+            occurrence = n_segments / max(self.n_times / self.sfreq, 1e-16)
         else:
-            stats['duration'][k] = 0
-            stats['occurrence'][k] = 0
+            occurrence = np.zeros(self.n_states)
+        transition = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
 
-    return stats
+        stats = {
+            'duration': duration,      # Mean duration
+            'occurrence': occurrence,  # Occurrences per second
+            'coverage': coverage,      # Fraction of time
+            'transition': transition,  # Transition probabilities
+        }
+        if self.gfp_sum_sq > 0:
+            stats['gev'] = self.explained / self.gfp_sum_sq
+        return stats
+
+class StreamingMicrostateLabeler:
+    """
+    Online microstate labelling of a live EEG stream with fixed maps.
+
+    Every pushed chunk is average-referenced and backfitted against the maps
+    (absolute spatial correlation, polarity ignored), then smoothed causally:
+    a new state only replaces the current one after it has won for
+    `min_duration` consecutive samples, so brief flips are suppressed without
+    waiting for future samples. Unlike `smooth_segmentation`, switches are
+    therefore reported up to min_duration - 1 samples late.
+
+    Parameters:
+    -----------
+    maps : array, shape (n_states, n_channels)
+        Microstate maps, e.g. from `segment_microstates`.
+    min_duration : int
+        Minimum number of consecutive samples before switching state.
+    average_reference : bool
+        Re-reference every sample to the channel average before fitting (as
+        the maps are typically computed from average-referenced data).
+    n_latencies : int
+        Number of recent push() latencies kept for latency_stats().
+    """
+
+    def __init__(self, maps, min_duration=0, average_reference=True, n_latencies=10000):
+        maps = np.asarray(maps, dtype=float)
+        self.maps = maps / np.linalg.norm(maps, axis=1, keepdims=True)
+        self.n_states, self.n_channels = self.maps.shape
+        self.min_duration = int(min_duration)
+        self.average_reference = average_reference
+        self.latencies = deque(maxlen=n_latencies)
+        self.reset()
+
+    def reset(self):
+        """Forget the current state and the latency history."""
+        self._current = -1
+        self._candidate = -1
+        self._candidate_count = 0
+        self.n_seen = 0
+        self.latencies.clear()
+
+    def _smooth(self, raw_labels):
+        """Causal minimum-duration smoothing, one run of equal labels at a time."""
+        labels = np.empty_like(raw_labels)
+        values, starts, lengths = run_length_encode(raw_labels)
+        for value, start, length in zip(values, starts, lengths):
+            if self._current < 0 or value == self._current:
+                # First sample of the stream, or the current state continues
+                self._current = value
+                self._candidate, self._candidate_count = -1, 0
+                labels[start:start + length] = value
+                continue
+
+            count = self._candidate_count if value == self._candidate else 0
+            need = max(self.min_duration - count, 1)
+            if length < need:
+                # Not long enough yet: keep reporting the current state
+                self._candidate, self._candidate_count = value, count + length
+                labels[start:start + length] = self._current
+            else:
+                # The candidate wins at its min_duration-th consecutive sample
+                labels[start:start + need - 1] = self._current
+                labels[start + need - 1:start + length] = value
+                self._current = value
+                self._candidate, self._candidate_count = -1, 0
+        return labels
+
+    def push(self, chunk):
+        """
+        Label a chunk of samples.
+
+        Parameters:
+        -----------
+        chunk : array, shape (n_channels, n_samples)
+
+        Returns:
+        --------
+        labels : array, shape (n_samples,)
+            Smoothed microstate label of every sample.
+        corr : array, shape (n_samples,)
+            Absolute correlation of every sample with its (smoothed) map.
+        """
+        t0 = time.perf_counter()
+        x = np.asarray(chunk, dtype=float)
+        if x.shape[0] != self.n_channels:
+            raise ValueError(f"Expected {self.n_channels} channels, got {x.shape[0]}")
+
+        if self.average_reference:
+            x = x - x.mean(axis=0, keepdims=True)
+
+        activation = np.abs(self.maps @ x)
+        activation /= np.linalg.norm(x, axis=0) + 1e-16
+
+        labels = self._smooth(np.argmax(activation, axis=0))
+        corr = activation[labels, np.arange(x.shape[1])]
+        self.n_seen += x.shape[1]
+
+        self.latencies.append(time.perf_counter() - t0)
+        return labels, corr
+
+    def latency_stats(self):
+        """
+        Percentiles of push() processing time, in milliseconds.
+
+        Returns:
+        --------
+        stats : dict
+            'n', 'mean', 'p50', 'p95', 'p99' and 'max'.
+        """
+        lat = np.array(self.latencies) * 1000.0
+        if len(lat) == 0:
+            return {'n': 0}
+        return {
+            'n': len(lat),
+            'mean': lat.mean(),
+            'p50': np.percentile(lat, 50),
+            'p95': np.percentile(lat, 95),
+            'p99': np.percentile(lat, 99),
+            'max': lat.max(),
+        }
@@ -0,0 +1,94 @@
+import time
+
+import mne
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from mne_preprocessing import prepare_ica_data, run_ica
+
+def create_dummy_data(n_channels=32, duration=300.0, sfreq=250.0, n_sources=15):
+    """
+    Raw with `n_sources` super-Gaussian sources (plus a slow drift and sensor
+    noise) mixed into `n_channels` standard_1020 EEG channels.
+    """
+    rng = np.random.RandomState(42)
+    montage = mne.channels.make_standard_montage('standard_1020')
+    ch_names = montage.ch_names[:n_channels]
+    n_times = int(duration * sfreq)
+    times = np.arange(n_times) / sfreq
+
+    sources = rng.laplace(size=(n_sources, n_times))
+    sources[0] = np.sin(2 * np.pi * 10 * times) # alpha
+    mixing = rng.randn(n_channels, n_sources)
+    drift = np.cumsum(rng.randn(n_channels, n_times), axis=1) * 0.01
+    data = (mixing @ sources + drift + 0.1 * rng.randn(n_channels, n_times)) * 1e-5
+
+    info = mne.create_info(ch_names, sfreq, 'eeg')
+    raw = mne.io.RawArray(data, info, verbose=False)
+    raw.set_montage(montage, verbose=False)
+    return raw
+
+def component_stability(ica_ref, ica):
+    """
+    Mean absolute correlation between matched component topographies
+    (Hungarian matching on |corr|) of two fits.
+    """
+    a = ica_ref.get_components()
+    b = ica.get_components()
+    a = (a - a.mean(0)) / np.linalg.norm(a - a.mean(0), axis=0)
+    b = (b - b.mean(0)) / np.linalg.norm(b - b.mean(0), axis=0)
+    corr = np.abs(a.T @ b)
+    rows, cols = linear_sum_assignment(-corr)
+    return corr[rows, cols].mean()
+
+def main():
+    mne.set_log_level('ERROR')
+    raw = create_dummy_data()
+    n_components = 15
+    print(f"Data: {len(raw.ch_names)} channels, {raw.times[-1]:.0f} s at {raw.info['sfreq']:.0f} Hz, "
+          f"n_components={n_components}")
+
+    # Reference: the previous path (FastICA on every sample, high-passed data)
+    raw_hp = raw.copy().filter(l_freq=1.0, h_freq=None)
+    t0 = time.perf_counter()
+    ica_ref = run_ica(raw_hp, n_components=n_components, method='fastica')
+    t_ref = time.perf_counter() - t0
+
+    variants = [
+        ('fastica, decim=4', dict(method='fastica', decim=4)),
+        ('fastica, 120 s of segments', dict(method='fastica', max_duration=120)),
+        ('extended-infomax, decim=4', dict(method='extended-infomax', decim=4)),
+        ('picard, decim=4', dict(method='picard', decim=4)),
+    ]
+
+    results = [('fastica, full data', t_ref, ica_ref.n_iter_, 1.0)]
+    for name, kwargs in variants:
+        try:
+            t0 = time.perf_counter()
+            ica = run_ica(raw_hp, n_components=n_components, **kwargs)
+            results.append((name, time.perf_counter() - t0, ica.n_iter_,
+                            component_stability(ica_ref, ica)))
+        except Exception as e: # e.g. python-picard not installed
+            print(f"Skipping {name}: {e}")
+
+    print(f"\n{'variant':<30}{'time (s)':>10}{'iters':>8}{'speedup':>9}{'stability':>11}")
+    for name, t, n_iter, stability in results:
+        print(f"{name:<30}{t:>10.2f}{n_iter:>8}{t_ref / t:>8.1f}x{stability:>11.3f}")
+
+    # n_components sweep: filter once and reuse the prepared data
+    sweep = (10, 15, 20)
+    t0 = time.perf_counter()
+    for n in sweep:
+        run_ica(raw, n_components=n, decim=4, l_freq=1.0)
+    t_separate = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    fit_data = prepare_ica_data(raw, l_freq=1.0)
+    for n in sweep:
+        run_ica(raw, n_components=n, decim=4, fit_data=fit_data)
+    t_reuse = time.perf_counter() - t0
+    print(f"\nn_components sweep {sweep}: {t_separate:.2f} s filtering per fit, "
+          f"{t_reuse:.2f} s with prepared data reused")
+
+if __name__ == "__main__":
+    main()
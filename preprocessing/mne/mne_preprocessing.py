@@ -1,21 +1,34 @@
 import mne
 import os
+import time
+from functools import lru_cache
+
 import numpy as np
 
-def load_data(file_path):
+try:
+    # Private MNE API: without it, interpolate_bad_channels uses raw.interpolate_bads
+    from mne.channels.interpolation import _make_interpolation_matrix
+except ImportError:
+    _make_interpolation_matrix = None
+
+def load_data(file_path, preload=True):
     """
     Load EEG data based on file extension.
+
+    preload: True loads the data into memory, False reads it lazily from
+    disk, and a file path memory-maps the data to that file (a disk-backed
+    buffer that preprocess_basic(..., low_memory=True) filters in place).
     """
     print(f"Loading data from {file_path}")
     _, ext = os.path.splitext(file_path)
     if ext == '.fif':
-        raw = mne.io.read_raw_fif(file_path, preload=True)
+        raw = mne.io.read_raw_fif(file_path, preload=preload)
     elif ext == '.set':
-        raw = mne.io.read_raw_eeglab(file_path, preload=True)
+        raw = mne.io.read_raw_eeglab(file_path, preload=preload)
     elif ext == '.edf':
-        raw = mne.io.read_raw_edf(file_path, preload=True)
+        raw = mne.io.read_raw_edf(file_path, preload=preload)
     elif ext == '.vhdr':
-        raw = mne.io.read_raw_brainvision(file_path, preload=True)
+        raw = mne.io.read_raw_brainvision(file_path, preload=preload)
     else:
         raise ValueError(f"Unsupported file extension: {ext}")
     return raw
@@ -32,11 +45,182 @@ def set_montage(raw, montage_name='standard_1020'):
         print(f"Warning: Could not set montage. {e}")
     return raw
 
-def interpolate_bad_channels(raw, bads=None, mode='accurate'):
+def _channel_neighbors(raw, picks, n_neighbors):
+    """Indices (into picks) of the n_neighbors nearest channels of each channel."""
+    pos = np.array([raw.info['chs'][p]['loc'][:3] for p in picks])
+    n_neighbors = min(n_neighbors, len(picks) - 1)
+    if not np.all(np.isfinite(pos)) or np.allclose(pos, 0):
+        # No montage: every other channel is a neighbour
+        others = np.array([np.delete(np.arange(len(picks)), i) for i in range(len(picks))])
+        return others
+    dist = np.linalg.norm(pos[:, np.newaxis] - pos[np.newaxis], axis=-1)
+    np.fill_diagonal(dist, np.inf)
+    return np.argsort(dist, axis=1)[:, :n_neighbors]
+
+def _robust_z(x):
+    """(x - median) / (1.4826 * MAD) across channels."""
+    med = np.median(x)
+    mad = 1.4826 * np.median(np.abs(x - med))
+    return (x - med) / mad if mad > 0 else np.zeros_like(x)
+
+def _longest_run(flags):
+    """Longest run of True along the last axis of a 2D boolean array."""
+    longest = np.zeros(flags.shape[0], dtype=int)
+    current = np.zeros(flags.shape[0], dtype=int)
+    for column in flags.T:
+        current = np.where(column, current + 1, 0)
+        np.maximum(longest, current, out=longest)
+    return longest
+
+def find_bad_channels(raw, window=1.0, chunk_duration=30.0, n_neighbors=6, z_threshold=5.0,
+                      corr_threshold=0.4, bad_window_fraction=0.01, hf_cutoff=50.0,
+                      flat_threshold=1e-10, flat_duration=5.0):
+    """
+    Detect bad EEG channels in one chunked pass over the data.
+
+    The data are read in chunks of `chunk_duration` seconds and cut into
+    `window` s windows; per window and channel the standard deviation, the
+    highest correlation with the `n_neighbors` nearest channels and the
+    high-frequency (> hf_cutoff) to low-frequency amplitude ratio are
+    computed for all channels at once. A channel is bad if
+    - its median amplitude is an outlier (|robust z| > z_threshold),
+    - its neighbour correlation is below corr_threshold in more than
+      bad_window_fraction of the windows,
+    - its high-frequency noise ratio has robust z > z_threshold, or
+    - it is flat (std < flat_threshold, in V) for flat_duration s in a row.
+
+    Returns:
+    --------
+    bads : list of str
+        Detected bad channel names.
+    scores : dict
+        Per-channel 'ch_names', 'amplitude_z', 'low_corr_fraction',
+        'hf_noise_z', 'flat_seconds' and the 'bads_by' criterion.
+    """
+    picks = mne.pick_types(raw.info, meg=False, eeg=True, exclude=[])
+    ch_names = [raw.ch_names[p] for p in picks]
+    sfreq = raw.info['sfreq']
+    win = int(round(window * sfreq))
+    if raw.n_times < win:
+        # Shorter than one window: the whole recording is the only window
+        print(f"Recording shorter than window={window} s, using a single window")
+        win = raw.n_times
+    if win < 2:
+        raise ValueError(f"Cannot detect bad channels in a recording of {raw.n_times} samples")
+    n_windows = raw.n_times // win
+    chunk_windows = max(1, int(chunk_duration // window))
+    neighbors = _channel_neighbors(raw, picks, n_neighbors)
+
+    freqs = np.fft.rfftfreq(win, 1.0 / sfreq)
+    hf_mask = freqs >= hf_cutoff
+    taper = np.hanning(win)
+
+    stds, corrs, hf_ratios = [], [], []
+    for w0 in range(0, n_windows, chunk_windows):
+        w1 = min(w0 + chunk_windows, n_windows)
+        chunk = raw.get_data(picks=picks, start=w0 * win, stop=w1 * win)
+        # (n_windows, n_channels, win)
+        windows = chunk.reshape(len(picks), w1 - w0, win).transpose(1, 0, 2)
+        windows = windows - windows.mean(axis=-1, keepdims=True)
+
+        norms = np.sqrt(np.einsum('wct,wct->wc', windows, windows))
+        stds.append(norms / np.sqrt(win))
+
+        # Correlation of every channel with its neighbours, all windows at once
+        safe = np.where(norms > 0, norms, np.inf)
+        normed = windows / safe[..., np.newaxis]
+        corr = np.matmul(normed, normed.transpose(0, 2, 1)) # (n_windows, n_ch, n_ch)
+        corr = corr[:, np.arange(len(picks))[:, np.newaxis], neighbors]
+        corrs.append(np.abs(corr).max(axis=-1))
+
+        if hf_mask.any():
+            power = np.abs(np.fft.rfft(windows * taper, axis=-1))**2
+            hf = power[..., hf_mask].sum(axis=-1)
+            lf = power[..., ~hf_mask].sum(axis=-1)
+            hf_ratios.append(np.sqrt(hf / np.where(lf > 0, lf, np.inf)))
+        else:
+            hf_ratios.append(np.zeros(norms.shape))
+
+    stds = np.concatenate(stds).T # (n_channels, n_windows)
+    corrs = np.concatenate(corrs).T
+    hf_ratios = np.concatenate(hf_ratios).T
+
+    flat = stds < flat_threshold
+    flat_seconds = _longest_run(flat) * win / sfreq
+    amplitude = np.median(stds, axis=1)
+    amplitude_z = _robust_z(np.log(np.maximum(amplitude, flat_threshold)))
+    low_corr_fraction = np.mean((corrs < corr_threshold) & ~flat, axis=1)
+    hf_noise_z = _robust_z(np.median(hf_ratios, axis=1))
+
+    bads_by = {
+        'flat': flat_seconds >= flat_duration,
+        'amplitude': np.abs(amplitude_z) > z_threshold,
+        'correlation': low_corr_fraction > bad_window_fraction,
+        'hf_noise': hf_noise_z > z_threshold,
+    }
+    is_bad = np.any(list(bads_by.values()), axis=0)
+    bads = [ch for ch, bad in zip(ch_names, is_bad) if bad]
+
+    scores = {
+        'ch_names': ch_names,
+        'amplitude_z': amplitude_z,
+        'low_corr_fraction': low_corr_fraction,
+        'hf_noise_z': hf_noise_z,
+        'flat_seconds': flat_seconds,
+        'bads_by': {key: [ch for ch, bad in zip(ch_names, mask) if bad]
+                    for key, mask in bads_by.items()},
+    }
+    print(f"Detected bad channels: {bads}")
+    return bads, scores
+
+@lru_cache(maxsize=32)
+def _eeg_interpolation_matrix(pos_good, pos_bad):
+    """
+    Spherical-spline interpolation matrix, cached on the sensor positions
+    (tuples of (x, y, z) relative to the head origin), i.e. per montage and
+    bad-channel set.
+    """
+    return _make_interpolation_matrix(np.array(pos_good), np.array(pos_bad))
+
+def _interpolate_eeg_cached(raw):
+    """
+    Interpolate bad EEG channels with the cached interpolation matrix.
+
+    Leaves the Raw unchanged (bads still marked) if the MNE version lacks
+    the private interpolation helper.
+    """
+    if _make_interpolation_matrix is None:
+        return raw
+    picks = mne.pick_types(raw.info, meg=False, eeg=True, exclude=[])
+    is_bad = np.array([raw.ch_names[p] in raw.info['bads'] for p in picks])
+    if not is_bad.any():
+        return raw
+
+    origin = mne.bem.fit_sphere_to_headshape(raw.info, units='m', verbose=False)[1]
+    pos = np.array([raw.info['chs'][p]['loc'][:3] for p in picks]) - origin
+    as_key = lambda x: tuple(map(tuple, np.round(x, 9)))
+    interpolation = _eeg_interpolation_matrix(as_key(pos[~is_bad]), as_key(pos[is_bad]))
+
+    def interpolate(x):
+        x[is_bad] = interpolation @ x[~is_bad]
+        return x
+
+    raw.apply_function(interpolate, picks=picks, channel_wise=False)
+    bad_names = {raw.ch_names[p] for p in picks[is_bad]}
+    raw.info['bads'] = [ch for ch in raw.info['bads'] if ch not in bad_names]
+    return raw
+
+def interpolate_bad_channels(raw, bads=None, mode='accurate', **detect_kwargs):
     """
     Mark and interpolate bad channels.
     bads: list of bad channel names. If None, uses raw.info['bads'].
+        'auto' detects them with find_bad_channels(raw, **detect_kwargs).
+    EEG channels are interpolated with a spherical-spline matrix that is
+    cached per montage and bad set, so subjects with the same bads reuse it.
     """
+    if isinstance(bads, str) and bads == 'auto':
+        bads, _ = find_bad_channels(raw, **detect_kwargs)
+
     if bads:
         raw.info['bads'].extend(bads)
         # remove duplicates
@@ -46,39 +230,145 @@ def interpolate_bad_channels(raw, bads=None, mode='accurate'):
 
     if raw.info['bads']:
         print("Interpolating bad channels...")
-        raw.interpolate_bads(reset_bads=True, mode=mode)
+        _interpolate_eeg_cached(raw)
+        if raw.info['bads']:
+            # Remaining bad channels (non-EEG, or all without the cached path)
+            raw.interpolate_bads(reset_bads=True, mode=mode)
     else:
         print("No bad channels to interpolate.")
 
     return raw
 
-def preprocess_basic(raw, l_freq=1.0, h_freq=40.0, notch_freq=None):
+def _average_reference_blocks(raw, block_size=None):
+    """
+    Average reference without full-size copies.
+
+    The reference signal is accumulated over blocks of `block_size` good EEG
+    channels, then subtracted one channel at a time in place. Bad channels
+    are excluded and left untouched, as with the average-reference projector.
+    """
+    eeg = mne.pick_types(raw.info, meg=False, eeg=True, exclude='bads')
+    if len(eeg) == 0:
+        print("No EEG channels to re-reference.")
+        return raw
+    if block_size is None:
+        # ~256 MB of float64 per block
+        block_size = max(1, 2**28 // (8 * raw.n_times))
+
+    ref = np.zeros(raw.n_times)
+    for start in range(0, len(eeg), block_size):
+        ref += raw.get_data(picks=eeg[start:start + block_size]).sum(axis=0)
+    ref /= len(eeg)
+
+    # channel_wise with n_jobs=1 writes each channel back in place
+    raw.apply_function(lambda x: x - ref, picks=eeg, channel_wise=True, n_jobs=1)
+    # Record that a custom (average) reference is applied
+    raw.set_eeg_reference(ref_channels=[])
+    return raw
+
+def preprocess_basic(raw, l_freq=1.0, h_freq=40.0, notch_freq=None, low_memory=False,
+                     block_size=None):
     """
     Basic preprocessing: Filter and Re-reference.
+
+    low_memory: for recordings that do not fit in RAM several times over.
+    Load them memory-mapped (load_data(file_path, preload='buffer.dat')); the
+    FIR filters then run with n_jobs=1, which writes each filtered channel
+    back into the disk-backed buffer (with MNE's default n_jobs=None all
+    filtered channels are first collected in memory, a full-size copy), and
+    the average reference is computed in blocks of `block_size` channels
+    instead of through a projector (whose application copies the whole
+    array into memory).
     """
+    if low_memory and not raw.preload:
+        raise ValueError("low_memory needs preloaded or memory-mapped data, "
+                         "e.g. load_data(file_path, preload='buffer.dat')")
+
+    # n_jobs=1 filters one channel at a time in place; n_jobs=None (MNE's
+    # default) goes through the parallel path, which returns all filtered
+    # channels at once before writing them back
+    n_jobs = 1 if low_memory else None
+
     # Filter
     print(f"Filtering ({l_freq}-{h_freq} Hz)...")
-    raw.filter(l_freq=l_freq, h_freq=h_freq)
+    raw.filter(l_freq=l_freq, h_freq=h_freq, n_jobs=n_jobs)
 
     if notch_freq:
         print(f"Notch filtering at {notch_freq} Hz...")
-        raw.notch_filter(freqs=notch_freq)
+        raw.notch_filter(freqs=notch_freq, n_jobs=n_jobs)
 
     # Re-reference
     print("Re-referencing to average...")
-    raw.set_eeg_reference('average', projection=True)
-    raw.apply_proj()
+    if low_memory:
+        _average_reference_blocks(raw, block_size)
+    else:
+        raw.set_eeg_reference('average', projection=True)
+        raw.apply_proj()
 
     return raw
 
-def run_ica(raw, n_components=20, method='fastica', random_state=97):
+def prepare_ica_data(raw, l_freq=None, max_duration=None, segment_length=2.0,
+                     reject_by_annotation=True, random_state=97):
+    """
+    Data to fit ICA on: an optionally high-passed copy of raw, optionally
+    reduced to a random subset of good segments.
+
+    The result can be passed to run_ica(..., fit_data=...) for repeated fits
+    (e.g. different n_components or methods) without filtering again.
+
+    l_freq: high-pass cutoff of the copy (e.g. 1.0). ICA fitted on it can be
+        applied to the original raw. None fits on raw itself (no copy).
+    max_duration: total length in seconds of random `segment_length` s
+        segments to keep. Segments overlapping BAD annotations are skipped
+        when reject_by_annotation is True. None keeps all data.
+    """
+    fit_data = raw
+    if l_freq is not None:
+        print(f"High-passing a copy at {l_freq} Hz for ICA...")
+        fit_data = raw.copy().filter(l_freq=l_freq, h_freq=None)
+
+    if max_duration is not None and max_duration < raw.times[-1]:
+        epochs = mne.make_fixed_length_epochs(fit_data, duration=segment_length,
+                                              reject_by_annotation=reject_by_annotation,
+                                              preload=False, verbose=False)
+        # Drop segments overlapping BAD annotations (reads, but does not keep, the data)
+        epochs.drop_bad(verbose=False)
+        n_keep = min(len(epochs), max(1, int(max_duration // segment_length)))
+        rng = np.random.RandomState(random_state)
+        keep = np.sort(rng.choice(len(epochs), n_keep, replace=False))
+        print(f"Fitting ICA on {n_keep} of {len(epochs)} good {segment_length} s segments")
+        fit_data = epochs[keep].load_data()
+
+    return fit_data
+
+def run_ica(raw, n_components=20, method='fastica', random_state=97, max_iter=800,
+            decim=None, l_freq=None, max_duration=None, fit_data=None):
     """
     Run ICA.
     Returns the ICA object. Does NOT apply it to raw yet (needs manual component selection).
+
+    method: 'fastica', 'picard' (needs python-picard; usually converges in far
+        fewer iterations), 'infomax' or 'extended-infomax'.
+    decim: fit on every decim-th sample only.
+    l_freq, max_duration: fit on a high-passed copy and/or a random subset
+        of good segments (see prepare_ica_data).
+    fit_data: Raw or Epochs from prepare_ica_data to reuse across fits;
+        overrides l_freq and max_duration.
     """
+    fit_params = None
+    if method == 'extended-infomax':
+        method, fit_params = 'infomax', dict(extended=True)
+
+    if fit_data is None:
+        fit_data = prepare_ica_data(raw, l_freq=l_freq, max_duration=max_duration,
+                                    random_state=random_state)
+
     print(f"Running ICA (method={method}, n_components={n_components})...")
-    ica = mne.preprocessing.ICA(n_components=n_components, method=method, random_state=random_state, max_iter=800)
-    ica.fit(raw)
+    ica = mne.preprocessing.ICA(n_components=n_components, method=method, fit_params=fit_params,
+                                random_state=random_state, max_iter=max_iter)
+    t0 = time.perf_counter()
+    ica.fit(fit_data, decim=decim)
+    print(f"ICA fitted in {time.perf_counter() - t0:.2f} s ({ica.n_iter_} iterations)")
     return ica
 
 def save_data(raw, output_path):
@@ -111,7 +401,7 @@ if __name__ == "__main__":
 
         # 4. Bad Channel Handling
         # Manually specifying bad channels for demonstration (bad channels might be identified visually)
-        # In a real pipeline, you might use autoreject or similar tools to find them.
+        # In a real pipeline, pass bads='auto' to detect them with find_bad_channels.
         bad_channels = ['EEG 053']
         raw = interpolate_bad_channels(raw, bads=bad_channels)
 
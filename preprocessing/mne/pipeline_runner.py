@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import mne
+
+from mne_preprocessing import (load_data, set_montage, interpolate_bad_channels,
+                               preprocess_basic, run_ica, save_data, save_ica)
+from step_cache import StepCache, input_files
+
+# Step name -> function. Every step takes the Raw as first argument and
+# returns the Raw, except run_ica which returns an ICA object.
+STEPS = {
+    'set_montage': set_montage,
+    'interpolate_bad_channels': interpolate_bad_channels,
+    'preprocess_basic': preprocess_basic,
+    'run_ica': run_ica,
+}
+
+def _current_rss():
+    """Current resident memory of this process in bytes (None if unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class _StepMemory:
+    """
+    Peak resident memory while a step runs, sampled in a background thread.
+
+    Unlike ru_maxrss (the peak over the process lifetime) the value is per
+    step, so it does not carry over between steps or between subjects run
+    in the same worker. Gives None where /proc/self/statm is unavailable.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start = None
+        self.peak = None
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, _current_rss())
+
+    def __enter__(self):
+        self.start = self.peak = _current_rss()
+        self._done = threading.Event()
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        if self.start is not None:
+            self._thread.join()
+            self.peak = max(self.peak, _current_rss())
+
+    def report(self):
+        """'peak_rss_mb' during the step and 'rss_increase_mb' over its start."""
+        if self.start is None:
+            return {'peak_rss_mb': None, 'rss_increase_mb': None}
+        return {'peak_rss_mb': self.peak / 1024.0**2,
+                'rss_increase_mb': (self.peak - self.start) / 1024.0**2}
+
+def _available_memory():
+    """Available physical memory in bytes (None if unknown)."""
+    # MemAvailable includes reclaimable page cache, unlike the free pages
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def _step_key(steps, idx):
+    """Hash of the step config up to and including step idx."""
+    blob = json.dumps([[name, params] for name, params in steps[:idx + 1]], sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+def _subject_name(file_path):
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+def _input_fingerprint(file_path):
+    """(path, size, mtime_ns) of the input file and its sidecars."""
+    return [[f, os.stat(f).st_size, os.stat(f).st_mtime_ns] for f in input_files(file_path)]
+
+def _load_state(state_path):
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            return json.load(f)
+    return {'completed': [], 'timings': []}
+
+def _save_state(state_path, state):
+    # Write-then-rename so a crash never leaves a truncated state file
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+def run_subject(file_path, steps, output_dir, cache_dir=None, cache_max_bytes=20 * 1024**3,
+                preload=True):
+    """
+    Run the preprocessing steps on one file, with checkpoints to resume from.
+
+    After every step the Raw (or ICA) is saved to `output_dir/<subject>/` and
+    a state file records the completed steps and the input file's size and
+    mtime. On a re-run the last checkpoint whose step config is unchanged is
+    loaded and the remaining steps are executed; if the input file changed,
+    all steps are rerun.
+
+    Parameters:
+    -----------
+    file_path : str
+        Input file (any format supported by load_data).
+    steps : list of (str, dict)
+        Step names (keys of STEPS) and their keyword arguments, in order.
+    output_dir : str
+        Root directory for checkpoints, logs and final outputs.
+    cache_dir : str | None
+        Shared StepCache directory. Steps whose output is cached (same input
+        file content, step parameters and MNE version) are loaded instead of
+        recomputed, and new outputs are added to the cache.
+    cache_max_bytes : int
+        Size limit of the cache (LRU eviction).
+    preload : True | 'memmap'
+        'memmap' memory-maps the input to `<subject>/buffer.dat` instead of
+        loading it into RAM (use with preprocess_basic's low_memory=True).
+        Cached outputs are memory-mapped as well, alternating with
+        `<subject>/buffer_b.dat` so a hit never overwrites the buffer the
+        current Raw is mapped to. The buffers are deleted once the subject
+        has finished (resuming maps the last checkpoint again).
+
+    Returns:
+    --------
+    report : dict
+        'file', 'status' ('done' or 'error'), 'steps' (name, wall_time in s,
+        peak_rss_mb and rss_increase_mb during the step, resumed, cached)
+        and 'error'.
+    """
+    subject = _subject_name(file_path)
+    subject_dir = os.path.join(output_dir, subject)
+    os.makedirs(subject_dir, exist_ok=True)
+    state_path = os.path.join(subject_dir, 'state.json')
+    state = _load_state(state_path)
+
+    report = {'file': file_path, 'status': 'done', 'steps': [], 'error': None}
+
+    # Checkpoints of a different (or modified) input file are stale
+    try:
+        fingerprint = _input_fingerprint(file_path)
+    except Exception: # unreadable input, reported by load_data below
+        fingerprint = None
+    if state.get('input') != fingerprint:
+        if state['completed']:
+            print(f"[{subject}] Input file changed, discarding checkpoints")
+        state = {'input': fingerprint, 'completed': [], 'timings': []}
+
+    # Find the last completed step whose config (and all before it) is unchanged
+    n_done = 0
+    for idx, entry in enumerate(state['completed']):
+        if idx < len(steps) and entry['key'] == _step_key(steps, idx):
+            n_done = idx + 1
+        else:
+            break
+    state['completed'] = state['completed'][:n_done]
+    state['timings'] = state['timings'][:n_done]
+
+    # Memory-map buffers: the current Raw uses one, a cache hit the other
+    buffer_paths = [os.path.join(subject_dir, 'buffer.dat'),
+                    os.path.join(subject_dir, 'buffer_b.dat')]
+    buffer_idx = 0
+    if preload == 'memmap':
+        read_preload = lambda idx: buffer_paths[idx]
+    else:
+        read_preload = lambda idx: preload
+    try:
+        cache, keys = None, None
+        if cache_dir is not None:
+            cache = StepCache(cache_dir, max_bytes=cache_max_bytes)
+            keys = cache.chain_keys(file_path, steps)
+
+        raw, ica = None, None
+        if n_done == 0:
+            t0 = time.perf_counter()
+            with _StepMemory() as memory:
+                raw = load_data(file_path, preload=read_preload(buffer_idx))
+            report['steps'].append(dict({'name': 'load_data', 'wall_time': time.perf_counter() - t0},
+                                        **memory.report(), resumed=False))
+        else:
+            print(f"[{subject}] Resuming after step {n_done}: {steps[n_done - 1][0]}")
+            raw = mne.io.read_raw_fif(state['completed'][n_done - 1]['raw'],
+                                      preload=read_preload(buffer_idx))
+            ica_path = state['completed'][n_done - 1].get('ica')
+            if ica_path:
+                ica = mne.preprocessing.read_ica(ica_path)
+            for timing in state['timings']:
+                report['steps'].append(dict(timing, resumed=True))
+
+        for idx in range(n_done, len(steps)):
+            name, params = steps[idx]
+            if name not in STEPS:
+                raise ValueError(f"Unknown step: {name}")
+
+            t0 = time.perf_counter()
+            with _StepMemory() as memory:
+                result = None
+                if cache is not None:
+                    result = cache.get(keys[idx], preload=read_preload(1 - buffer_idx))
+                cached = result is not None
+                if cached and not isinstance(result, mne.preprocessing.ICA):
+                    buffer_idx = 1 - buffer_idx
+                if not cached:
+                    result = STEPS[name](raw, **params)
+                    if cache is not None:
+                        cache.put(keys[idx], result)
+            wall_time = time.perf_counter() - t0
+
+            # Checkpoint: every entry points to the current Raw and ICA files
+            entry = {'name': name, 'key': _step_key(steps, idx)}
+            prev = state['completed'][-1] if state['completed'] else {}
+            entry['raw'] = None
+            if isinstance(result, mne.preprocessing.ICA):
+                ica = result
+                entry['ica'] = os.path.join(subject_dir, f'step{idx:02d}_{name}-ica.fif')
+                save_ica(ica, entry['ica'])
+                # ICA fitting leaves the Raw unchanged
+                entry['raw'] = prev.get('raw')
+            else:
+                raw = result
+                entry['ica'] = prev.get('ica')
+            if entry['raw'] is None:
+                entry['raw'] = os.path.join(subject_dir, f'step{idx:02d}_{name}_raw.fif')
+                save_data(raw, entry['raw'])
+
+            timing = dict({'name': name, 'wall_time': wall_time}, **memory.report())
+            state['completed'].append(entry)
+            state['timings'].append(timing)
+            _save_state(state_path, state)
+
+            report['steps'].append(dict(timing, resumed=False, cached=cached))
+            rss = timing['rss_increase_mb']
+            print(f"[{subject}] {name}: {wall_time:.2f} s{' (cached)' if cached else ''}"
+                  + (f", +{rss:.1f} MB RSS" if rss is not None else ""))
+
+        # Final outputs
+        if raw is not None:
+            save_data(raw, os.path.join(output_dir, f'{subject}_preprocessed_raw.fif'))
+        if ica is not None:
+            save_ica(ica, os.path.join(output_dir, f'{subject}-ica.fif'))
+
+    except Exception as e:
+        report['status'] = 'error'
+        report['error'] = f"{type(e).__name__}: {e}"
+        print(f"[{subject}] Failed: {report['error']}")
+
+    # Release the memory map before deleting its file
+    raw = ica = result = None
+    for buffer_path in buffer_paths:
+        if os.path.exists(buffer_path):
+            os.remove(buffer_path)
+
+    with open(os.path.join(subject_dir, 'report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return report
+
+def estimate_subject_memory(file_path, factor=4.0):
+    """
+    Rough peak memory (bytes) to preprocess one file: `factor` times the
+    float64 size of its data (loading, filtering and ICA make copies).
+    """
+    raw = mne.io.read_raw(file_path, preload=False, verbose=False)
+    return int(factor * raw.info['nchan'] * raw.n_times * 8)
+
+def run_pipeline(file_paths, steps, output_dir, n_jobs=1, memory_per_subject=None,
+                 memory_fraction=0.8, cache_dir=None, cache_max_bytes=20 * 1024**3,
+                 preload=True):
+    """
+    Preprocess many subjects in parallel worker processes.
+
+    Concurrency is capped by the available RAM: at most
+    memory_fraction * available / memory_per_subject subjects run at once.
+    Each subject resumes from its last checkpoint (see run_subject). Outputs
+    are named after the input file name, which must be unique.
+
+    Parameters:
+    -----------
+    file_paths : list of str
+        Input files, one per subject.
+    steps : list of (str, dict)
+        Step names (keys of STEPS) and their keyword arguments, in order.
+        load_data is always run first.
+    output_dir : str
+        Root directory for checkpoints, logs and outputs.
+    n_jobs : int
+        Maximum number of worker processes.
+    memory_per_subject : int | None
+        Expected peak memory per subject in bytes. None estimates it from the
+        largest input file with estimate_subject_memory.
+    memory_fraction : float
+        Fraction of the available memory the workers may use.
+    cache_dir : str | None
+        StepCache directory shared by all workers (see run_subject).
+    cache_max_bytes : int
+        Size limit of the cache.
+    preload : True | 'memmap'
+        How each subject's data is loaded (see run_subject).
+
+    Returns:
+    --------
+    reports : list of dict
+        One report per file (see run_subject), in input order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    # Subjects share output_dir/<subject>/, so file names must be unique
+    subjects = [_subject_name(f) for f in file_paths]
+    duplicates = sorted({s for s in subjects if subjects.count(s) > 1})
+    if duplicates:
+        raise ValueError(f"Subject file names must be unique, got duplicates: {duplicates}")
+
+    available = _available_memory()
+    if memory_per_subject is None and available is not None and file_paths:
+        # Memory-mapped subjects keep little more than one channel in RAM
+        factor = 0.5 if preload == 'memmap' else 4.0
+        memory_per_subject = max(estimate_subject_memory(f, factor) for f in file_paths)
+    if available is not None and memory_per_subject:
+        max_by_memory = max(1, int(memory_fraction * available // memory_per_subject))
+        if max_by_memory < n_jobs:
+            print(f"Limiting to {max_by_memory} workers "
+                  f"({available / 1024**3:.1f} GB available, "
+                  f"~{memory_per_subject / 1024**3:.1f} GB per subject)")
+        n_jobs = min(n_jobs, max_by_memory)
+
+    if n_jobs == 1:
+        reports = [run_subject(f, steps, output_dir, cache_dir, cache_max_bytes, preload)
+                   for f in file_paths]
+    else:
+        reports = [None] * len(file_paths)
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            futures = {pool.submit(run_subject, f, steps, output_dir, cache_dir,
+                                   cache_max_bytes, preload): i
+                       for i, f in enumerate(file_paths)}
+            for future in as_completed(futures):
+                reports[futures[future]] = future.result()
+
+    n_failed = sum(r['status'] != 'done' for r in reports)
+    print(f"Pipeline finished: {len(reports) - n_failed} done, {n_failed} failed.")
+
+    with open(os.path.join(output_dir, 'pipeline_report.json'), 'w') as f:
+        json.dump(reports, f, indent=2)
+
+    return reports
+
+if __name__ == "__main__":
+    # Example: the MNE sample recording, split into "subjects"
+    try:
+        sample_data_folder = mne.datasets.sample.data_path()
+        raw_fname = os.path.join(sample_data_folder, 'MEG', 'sample', 'sample_audvis_raw.fif')
+        output_dir = 'pipeline_output'
+
+        steps = [
+            ('interpolate_bad_channels', {'bads': ['EEG 053']}),
+            ('preprocess_basic', {'l_freq': 1.0, 'h_freq': 40.0}),
+            ('run_ica', {'n_components': 15, 'method': 'fastica'}),
+        ]
+
+        reports = run_pipeline([raw_fname], steps, output_dir, n_jobs=2,
+                               cache_dir='preprocessing_cache')
+        for report in reports:
+            for step in report['steps']:
+                print(f"{step['name']}: {step['wall_time']:.2f} s")
+
+    except Exception as e:
+        print(f"Error during example run: {e}")
@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+
+import mne
+
+from mne_preprocessing import load_data
+
+def input_files(file_path):
+    """
+    All files a recording is read from: the file itself plus its sidecars
+    (the .fdt of a .set, the .eeg/.vmrk of a .vhdr, FIF split files), as
+    absolute paths.
+    """
+    file_path = os.path.abspath(file_path)
+    raw = mne.io.read_raw(file_path, preload=False, verbose=False)
+    files = [file_path] + [os.path.abspath(str(f)) for f in raw.filenames if f is not None]
+    # The BrainVision marker file is parsed by read_raw but not listed
+    stem, ext = os.path.splitext(file_path)
+    if ext.lower() == '.vhdr' and os.path.exists(stem + '.vmrk'):
+        files.append(stem + '.vmrk')
+    return sorted(set(files), key=files.index)
+
+class StepCache:
+    """
+    Content-addressed on-disk cache for preprocessing step outputs.
+
+    Every step output is stored under a key that chains the input file
+    content (including sidecar data files), the name and parameters of all
+    steps so far, and the MNE version. Changing a late step therefore still
+    hits the cache for all earlier steps, and editing (or replacing) the
+    input file or its data files invalidates everything derived from it.
+
+    Entries are directories `<cache_dir>/<key>/` holding `step_raw.fif` or
+    `step-ica.fif`. They are written to a temporary directory and renamed
+    into place, so concurrent workers never see half-written entries. Hits
+    refresh the entry's mtime, and the least recently used entries are
+    evicted once the cache exceeds `max_bytes`.
+
+    Parameters:
+    -----------
+    cache_dir : str
+        Cache root (preferably on a local disk).
+    max_bytes : int
+        Size limit of the cache in bytes (default 20 GB).
+    """
+
+    def __init__(self, cache_dir, max_bytes=20 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(cache_dir, 'files'), exist_ok=True)
+
+    def file_key(self, file_path):
+        """
+        SHA-1 of the content of the file and its sidecars (plus the MNE version).
+
+        Hashing a large recording takes a while, so the digest is memoized in
+        `<cache_dir>/files/` and reused as long as the size and mtime of every
+        file are unchanged.
+        """
+        file_path = os.path.abspath(file_path)
+        files = input_files(file_path)
+        stats = [[f, os.stat(f).st_size, os.stat(f).st_mtime_ns] for f in files]
+        memo_path = os.path.join(self.cache_dir, 'files',
+                                 hashlib.sha1(file_path.encode()).hexdigest() + '.json')
+        if os.path.exists(memo_path):
+            with open(memo_path) as f:
+                memo = json.load(f)
+            if memo.get('files') == stats:
+                return memo['key']
+
+        h = hashlib.sha1()
+        for path in files:
+            # File names relative to the header, so moving a recording keeps its key
+            h.update(os.path.relpath(path, os.path.dirname(file_path)).encode())
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+        h.update(mne.__version__.encode())
+        key = h.hexdigest()
+
+        tmp_path = f'{memo_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'file': file_path, 'files': stats, 'key': key}, f)
+        os.replace(tmp_path, memo_path)
+        return key
+
+    @staticmethod
+    def step_key(parent_key, name, params):
+        """Key of a step output: hash of the parent key, step name and parameters."""
+        blob = json.dumps([parent_key, name, params, mne.__version__], sort_keys=True, default=str)
+        return hashlib.sha1(blob.encode()).hexdigest()
+
+    def chain_keys(self, file_path, steps):
+        """Keys of all step outputs for `file_path` processed by `steps`."""
+        keys = []
+        parent = self.file_key(file_path)
+        for name, params in steps:
+            parent = self.step_key(parent, name, params)
+            keys.append(parent)
+        return keys
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, key):
+        """
+        Path of the cached output for `key`, or None on a miss.
+
+        Returns the `step_raw.fif` or `step-ica.fif` path and refreshes the
+        entry's LRU timestamp.
+        """
+        entry_dir = self._entry_dir(key)
+        for fname in ('step_raw.fif', 'step-ica.fif'):
+            path = os.path.join(entry_dir, fname)
+            if os.path.exists(path):
+                try:
+                    os.utime(entry_dir)
+                except FileNotFoundError: # evicted by another worker
+                    return None
+                return path
+        return None
+
+    def get(self, key, preload=True):
+        """
+        Cached Raw or ICA for `key`, or None on a miss.
+
+        `preload` is passed to read_raw_fif for a Raw: True loads it into
+        memory, a file name memory-maps it to that file.
+        """
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            return _read_output(path, preload=preload)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, obj):
+        """
+        Store a Raw or ICA under `key`, then evict down to max_bytes.
+
+        Outputs larger than max_bytes on their own are not stored.
+        """
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+        tmp_dir = f'{entry_dir}.{os.getpid()}.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+        if isinstance(obj, mne.preprocessing.ICA):
+            obj.save(os.path.join(tmp_dir, 'step-ica.fif'), overwrite=True, verbose=False)
+        else:
+            obj.save(os.path.join(tmp_dir, 'step_raw.fif'), overwrite=True, verbose=False)
+        size = sum(os.path.getsize(os.path.join(tmp_dir, f)) for f in os.listdir(tmp_dir))
+        if size > self.max_bytes:
+            # It would only evict everything else and then itself
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError: # another worker stored the same key first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def _entries(self):
+        """(mtime, size, path) of all complete entries."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name == 'files' or name.endswith('.tmp') or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except FileNotFoundError: # removed concurrently
+                continue
+        return entries
+
+    def size(self):
+        """Total size of the cached outputs in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_bytes=None):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove all cached outputs."""
+        self.evict(max_bytes=0)
+
+    def resolve(self, file_path, steps, preload=True):
+        """
+        Find the longest cached prefix of `steps` for `file_path`.
+
+        Only the outputs needed to continue are loaded: the last cached Raw
+        (with `preload`, see get) and the last cached ICA of the prefix.
+
+        Returns:
+        --------
+        n_cached : int
+            Number of leading steps whose output is cached.
+        raw : Raw | None
+            Raw after step n_cached (None if n_cached is 0).
+        ica : ICA | None
+            Last ICA fitted within the cached prefix.
+        keys : list of str
+            Keys of all steps (see chain_keys).
+        """
+        keys = self.chain_keys(file_path, steps)
+        raw_path, ica_path = None, None
+        n_cached = 0
+        for key in keys:
+            path = self.lookup(key)
+            if path is None:
+                break
+            if path.endswith('-ica.fif'):
+                ica_path = path
+            else:
+                raw_path = path
+            n_cached += 1
+
+        # A prefix that is only ICA steps still needs the loaded input file
+        raw, ica = None, None
+        try:
+            if raw_path is not None:
+                raw = _read_output(raw_path, preload=preload)
+            elif n_cached:
+                raw = load_data(file_path, preload=preload)
+            if ica_path is not None:
+                ica = _read_output(ica_path)
+        except FileNotFoundError: # evicted between lookup and load
+            return 0, None, None, keys
+        return n_cached, raw, ica, keys
+
+def _read_output(path, preload=True):
+    if path.endswith('-ica.fif'):
+        return mne.preprocessing.read_ica(path, verbose=False)
+    return mne.io.read_raw_fif(path, preload=preload, verbose=False)
+
+def run_cached(file_path, steps, cache, step_funcs=None):
+    """
+    Run preprocessing steps on one file, reusing cached step outputs.
+
+    Parameters:
+    -----------
+    file_path : str
+    steps : list of (str, dict)
+        Step names and keyword arguments, in order (see pipeline_runner.STEPS).
+    cache : StepCache
+    step_funcs : dict | None
+        Step name -> function. None uses pipeline_runner.STEPS.
+
+    Returns:
+    --------
+    raw : Raw
+        Raw after the last step.
+    ica : ICA | None
+        Last fitted ICA, if any step returned one.
+    n_cached : int
+        Number of steps served from the cache.
+    """
+    if step_funcs is None:
+        from pipeline_runner import STEPS as step_funcs
+
+    n_cached, raw, ica, keys = cache.resolve(file_path, steps)
+    if n_cached:
+        print(f"Cache hit for {n_cached}/{len(steps)} steps of {os.path.basename(file_path)}")
+    else:
+        raw = load_data(file_path)
+
+    for idx in range(n_cached, len(steps)):
+        name, params = steps[idx]
+        t0 = time.perf_counter()
+        result = step_funcs[name](raw, **params)
+        print(f"{name}: {time.perf_counter() - t0:.2f} s")
+        if isinstance(result, mne.preprocessing.ICA):
+            ica = result
+        else:
+            raw = result
+        cache.put(keys[idx], result)
+
+    return raw, ica, n_cached
+
+if __name__ == "__main__":
+    # Example: a small parameter sweep over the ICA step only
+    try:
+        sample_data_folder = mne.datasets.sample.data_path()
+        raw_fname = os.path.join(sample_data_folder, 'MEG', 'sample', 'sample_audvis_raw.fif')
+        cache = StepCache('preprocessing_cache', max_bytes=5 * 1024**3)
+
+        for n_components in (10, 15, 20):
+            steps = [
+                ('interpolate_bad_channels', {'bads': ['EEG 053']}),
+                ('preprocess_basic', {'l_freq': 1.0, 'h_freq': 40.0}),
+                ('run_ica', {'n_components': n_components, 'method': 'fastica'}),
+            ]
+            t0 = time.perf_counter()
+            raw, ica, n_cached = run_cached(raw_fname, steps, cache)
+            print(f"n_components={n_components}: {time.perf_counter() - t0:.1f} s "
+                  f"({n_cached} steps from cache)")
+
+        print(f"Cache size: {cache.size() / 1024**2:.1f} MB")
+
+    except Exception as e:
+        print(f"Error during example run: {e}")
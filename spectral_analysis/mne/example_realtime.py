@@ -0,0 +1,52 @@
+import os
+import sys
+
+import numpy as np
+import mne
+from spectral_methods import BandPowerTracker
+
+# simulate_stream is shared with the other real-time example
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from realtime_utils import simulate_stream
+
+def create_dummy_data():
+    """Create dummy MNE Raw data with alpha bursts on the first channel."""
+    sfreq = 250
+    times = np.arange(0, 20, 1/sfreq)
+    rng = np.random.RandomState(42)
+    n_ch = 8
+
+    data = rng.randn(n_ch, len(times))
+    # 10 Hz alpha on channel 0 between 5 s and 10 s
+    burst = (times >= 5) & (times < 10)
+    data[0, burst] += 3 * np.sin(2 * np.pi * 10 * times[burst])
+
+    info = mne.create_info(ch_names=[f'EEG{i:02d}' for i in range(n_ch)], sfreq=sfreq, ch_types='eeg')
+    raw = mne.io.RawArray(data, info)
+    return raw
+
+def main():
+    print("Creating dummy data...")
+    raw = create_dummy_data()
+
+    bands = {'theta': (4, 8), 'alpha': (8, 12), 'beta': (13, 30)}
+    tracker = BandPowerTracker(raw.info['sfreq'], len(raw.ch_names), bands,
+                               window_size=1.0, update_interval=0.05, n_average=4)
+
+    print("\nStreaming...")
+    alpha_idx = tracker.band_names.index('alpha')
+    n_updates = 0
+    for t, chunk in simulate_stream(raw, chunk_duration=0.05, realtime=False):
+        updates = tracker.push(chunk)
+        for update in updates:
+            n_updates += 1
+            # Print once per second (20 updates)
+            if n_updates % 20 == 0:
+                print(f"t={t:5.2f}s  alpha power (ch 0): {update[0, alpha_idx]:.3f}")
+
+    stats = tracker.latency_stats()
+    print(f"\nLatency over {stats['n']} chunks: p50={stats['p50']:.3f} ms, "
+          f"p95={stats['p95']:.3f} ms, p99={stats['p99']:.3f} ms, max={stats['max']:.3f} ms")
+
+if __name__ == "__main__":
+    main()
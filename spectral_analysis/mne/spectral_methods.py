@@ -1,7 +1,17 @@
+import time
+import warnings
+from collections import deque
+from functools import lru_cache
+
 import mne
 import numpy as np
+from scipy import fft as sp_fft
+from scipy import signal
+from scipy.integrate import trapezoid
+from numpy.lib.stride_tricks import sliding_window_view
 
-def compute_psd_welch(inst, fmin=0, fmax=np.inf, n_fft=2048, n_overlap=0, n_per_seg=None):
+def compute_psd_welch(inst, fmin=0, fmax=np.inf, n_fft=2048, n_overlap=0, n_per_seg=None,
+                      block_size=None):
     """
     Compute Power Spectral Density (PSD) using Welch's method.
 
@@ -19,6 +29,10 @@ def compute_psd_welch(inst, fmin=0, fmax=np.inf, n_fft=2048, n_overlap=0, n_per_
         The number of points of overlap between segments.
     n_per_seg : int | None
         Length of each Welch segment (windowed). If None, n_per_seg is equal to n_fft.
+    block_size : int | None
+        For Raw input, stream the data in blocks of about this many samples
+        with `compute_psd_welch_streaming` instead of MNE's in-memory
+        implementation (the Raw does not need to be preloaded).
 
     Returns:
     --------
@@ -26,6 +40,11 @@ def compute_psd_welch(inst, fmin=0, fmax=np.inf, n_fft=2048, n_overlap=0, n_per_
         The spectrum object containing PSD data.
     """
 
+    if block_size is not None and hasattr(inst, 'n_times'):
+        return compute_psd_welch_streaming(inst, fmin=fmin, fmax=fmax, n_fft=n_fft,
+                                           n_overlap=n_overlap, n_per_seg=n_per_seg,
+                                           block_size=block_size)
+
     # Check if we are using newer MNE version which uses .compute_psd()
     if hasattr(inst, 'compute_psd'):
         # MNE 1.0+ style
@@ -35,7 +54,160 @@ def compute_psd_welch(inst, fmin=0, fmax=np.inf, n_fft=2048, n_overlap=0, n_per_
     else:
         raise NotImplementedError("This function requires a newer version of MNE-Python (>=1.2) that supports .compute_psd()")
 
-def compute_psd_fft(inst, fmin=0, fmax=np.inf):
+def _good_spans(raw, reject_by_annotation=True):
+    """(start, stop) sample spans of a Raw not covered by 'bad*' annotations."""
+    n_times = raw.n_times
+    annot = raw.annotations
+    if not reject_by_annotation or len(annot) == 0:
+        return [(0, n_times)]
+
+    is_bad = np.array([desc.lower().startswith('bad') for desc in annot.description])
+    if not is_bad.any():
+        return [(0, n_times)]
+
+    onsets = raw.time_as_index(annot.onset[is_bad], use_rounding=True, origin=annot.orig_time)
+    stops = raw.time_as_index(annot.onset[is_bad] + annot.duration[is_bad],
+                              use_rounding=True, origin=annot.orig_time)
+    order = np.argsort(onsets)
+
+    spans = []
+    pos = 0
+    for onset, stop in zip(np.clip(onsets[order], 0, n_times), np.clip(stops[order], 0, n_times)):
+        if onset > pos:
+            spans.append((pos, onset))
+        pos = max(pos, stop)
+    if pos < n_times:
+        spans.append((pos, n_times))
+    return spans
+
+def compute_psd_welch_streaming(raw, fmin=0, fmax=np.inf, n_fft=2048, n_overlap=0, n_per_seg=None,
+                                picks=None, reject_by_annotation=True, block_size=100000,
+                                window='hamming'):
+    """
+    Compute a Welch PSD of a Raw object without loading it into memory.
+
+    The recording is read in blocks with raw.get_data(start, stop); each
+    block covers whole Welch segments, read together with the overlap they
+    share with the next block, and the windowed periodograms are summed as
+    they are computed. Memory depends on `block_size`, not on the recording
+    length. Segments follow MNE's Welch (scipy.signal.spectrogram with
+    detrend='constant' and density scaling): with `reject_by_annotation`,
+    segments restart at every good span between 'bad*' annotations and span
+    averages are weighted by the number of analyzed samples. Good spans
+    shorter than `n_per_seg` are skipped (MNE shortens the window instead).
+
+    Parameters:
+    -----------
+    raw : mne.io.Raw
+        Continuous data, preloaded or not.
+    fmin, fmax : float
+        Frequency range to keep.
+    n_fft : int
+        The length of the FFT used, must be >= n_per_seg (default: 2048).
+    n_overlap : int
+        The number of points of overlap between segments.
+    n_per_seg : int | None
+        Length of each Welch segment (windowed). If None, n_per_seg is equal to n_fft.
+    picks : list of str | list of int | None
+        Channels to use. None uses all good data channels, like compute_psd.
+    reject_by_annotation : bool
+        Skip data covered by annotations whose description starts with 'bad'.
+    block_size : int
+        Approximate number of samples read at a time.
+    window : str
+        Window function, as in compute_psd (default 'hamming').
+
+    Returns:
+    --------
+    spectrum : mne.time_frequency.SpectrumArray
+        The spectrum object containing PSD data.
+    """
+    sfreq = raw.info['sfreq']
+    if n_per_seg is None:
+        n_per_seg = n_fft
+    step = max(n_per_seg - n_overlap, 1)
+
+    if picks is None:
+        picks = mne.pick_types(raw.info, meg=True, eeg=True, seeg=True, ecog=True, dbs=True,
+                               fnirs=True, exclude='bads')
+    else:
+        picks = np.array([raw.ch_names.index(p) if isinstance(p, str) else p for p in picks])
+
+    freqs = np.fft.rfftfreq(n_fft, 1.0 / sfreq)
+    freq_mask = (freqs >= fmin) & (freqs <= fmax)
+    if not freq_mask.any():
+        raise ValueError(f"No frequencies found between fmin={fmin} and fmax={fmax}")
+    bins = np.flatnonzero(freq_mask)
+    freqs = freqs[freq_mask]
+
+    win = signal.get_window(window, n_per_seg)
+    # scaling='density', one-sided (DC and Nyquist are not doubled)
+    scale = np.full(len(bins), 2.0 / (sfreq * np.sum(win**2)))
+    scale[bins == 0] /= 2
+    if n_fft % 2 == 0:
+        scale[bins == n_fft // 2] /= 2
+
+    # Segments per block
+    seg_per_block = max(1, (block_size - n_per_seg) // step + 1)
+
+    psd = np.zeros((len(picks), len(bins)))
+    total_weight = 0
+
+    for span_start, span_stop in _good_spans(raw, reject_by_annotation):
+        n_segments = (span_stop - span_start - n_per_seg) // step + 1
+        if n_segments <= 0:
+            continue
+
+        span_sum = np.zeros_like(psd)
+        for first in range(0, n_segments, seg_per_block):
+            n_block = min(seg_per_block, n_segments - first)
+            start = span_start + first * step
+            stop = start + (n_block - 1) * step + n_per_seg
+            block = raw.get_data(picks=picks, start=start, stop=stop)
+
+            frames = sliding_window_view(block, n_per_seg, axis=-1)[:, ::step][:, :n_block]
+            frames = (frames - frames.mean(axis=-1, keepdims=True)) * win
+            spec = sp_fft.rfft(frames, n=n_fft, axis=-1)[..., bins]
+            span_sum += (spec.real**2 + spec.imag**2).sum(axis=1)
+
+        # Weight span averages by the number of samples they analyze
+        weight = (n_segments - 1) * step + n_per_seg
+        psd += weight * span_sum / n_segments
+        total_weight += weight
+
+    if total_weight == 0:
+        raise ValueError("No good data segment is at least n_per_seg samples long")
+    psd *= scale / total_weight
+
+    return mne.time_frequency.SpectrumArray(psd, mne.pick_info(raw.info, picks), freqs)
+
+def _chunk_layout(inst):
+    """
+    Chunking layout of an instance for the manual PSD functions.
+
+    Raw/Evoked: (n_channels, n_times), chunks over channels.
+    Epochs: (n_epochs, n_channels, n_times), chunks over epochs. Bad epochs
+    are dropped first (in place, as get_data() would), since epochs can only
+    be indexed once rejection has been applied.
+    """
+    n_channels = inst.info['nchan']
+    is_epochs = hasattr(inst, 'events')
+    if is_epochs:
+        inst.drop_bad()
+        n_times = len(inst.times)
+        n_items = len(inst)
+    else:
+        n_times = inst.n_times if hasattr(inst, 'n_times') else len(inst.times)
+        n_items = n_channels
+    return is_epochs, n_items, n_channels, n_times
+
+def _read_chunk(inst, is_epochs, start, stop):
+    """Read epochs (Epochs) or channels (Raw/Evoked) start:stop."""
+    if is_epochs:
+        return inst.get_data(item=slice(start, stop))
+    return inst.get_data(picks=np.arange(start, stop))
+
+def compute_psd_fft(inst, fmin=0, fmax=np.inf, chunk_size=None, n_workers=None, dtype=np.float64):
     """
     Compute Power Spectral Density (PSD) using standard FFT (Periodogram).
 
@@ -50,6 +222,10 @@ def compute_psd_fft(inst, fmin=0, fmax=np.inf):
     For strict FFT on raw data without windowing/tapering (boxcar), we should use
     numpy directly or configure multitaper to behave like it.
 
+    The data can be processed in chunks (channels for Raw, epochs for Epochs),
+    and only the [fmin, fmax] slice of each spectrum is kept, so peak memory
+    is one chunk of FFT output plus the cropped result.
+
     Parameters:
     -----------
     inst : mne.io.Raw, mne.Epochs
@@ -58,6 +234,13 @@ def compute_psd_fft(inst, fmin=0, fmax=np.inf):
         Lower frequency.
     fmax : float
         Upper frequency.
+    chunk_size : int | None
+        Number of channels (Raw) or epochs (Epochs) read and transformed at
+        once. None processes everything in one block.
+    n_workers : int | None
+        Number of threads for scipy.fft (-1 uses all cores).
+    dtype : numpy dtype
+        Computation and output dtype (np.float32 halves memory).
 
     Returns:
     --------
@@ -73,50 +256,383 @@ def compute_psd_fft(inst, fmin=0, fmax=np.inf):
          # So we will implement a simple FFT based PSD manually for demonstration of "common fft method".
 
          sfreq = inst.info['sfreq']
-         data = inst.get_data() # (n_channels, n_times) or (n_epochs, n_channels, n_times)
-
-         # Handle raw vs epochs
-         if data.ndim == 2:
-             # Raw: (n_channels, n_times)
-             n_times = data.shape[1]
-             # simple fft
-             fft_vals = np.fft.rfft(data, axis=1)
-             psd = np.abs(fft_vals) ** 2 / (n_times * sfreq)
-             freqs = np.fft.rfftfreq(n_times, 1.0/sfreq)
-         elif data.ndim == 3:
-             # Epochs: (n_epochs, n_channels, n_times)
-             n_times = data.shape[2]
-             fft_vals = np.fft.rfft(data, axis=2)
-             psd = np.abs(fft_vals) ** 2 / (n_times * sfreq)
-             freqs = np.fft.rfftfreq(n_times, 1.0/sfreq)
-
-         # Apply one-sided scaling: multiply by 2 for all freqs except DC and Nyquist (if present)
-         # rfftfreq returns [0, 1, ..., n/2]
-         # psd matches this last dimension
+         is_epochs, n_items, n_channels, n_times = _chunk_layout(inst)
+         if chunk_size is None:
+             chunk_size = n_items
+
+         freqs = sp_fft.rfftfreq(n_times, 1.0/sfreq)
+         mask = (freqs >= fmin) & (freqs <= fmax)
+         bins = np.flatnonzero(mask)
+         freqs = freqs[mask]
 
+         # One-sided scaling: multiply by 2 for all freqs except DC and Nyquist (if present)
+         # rfftfreq returns [0, 1, ..., n/2]
+         scale = np.full(len(bins), 2.0 / (n_times * sfreq))
+         scale[bins == 0] /= 2
          if n_times % 2 == 0:
              # Last point is Nyquist
-             if data.ndim == 2:
-                 psd[:, 1:-1] *= 2
-             else:
-                 psd[:, :, 1:-1] *= 2
+             scale[bins == n_times // 2] /= 2
+         scale = scale.astype(dtype)
+
+         if is_epochs:
+             psd = np.empty((n_items, n_channels, len(bins)), dtype=dtype)
          else:
-             # No Nyquist point in rfft output (it goes up to (n-1)/2)
-             if data.ndim == 2:
-                 psd[:, 1:] *= 2
-             else:
-                 psd[:, :, 1:] *= 2
+             psd = np.empty((n_items, len(bins)), dtype=dtype)
 
-         # Crop to fmin/fmax
-         mask = (freqs >= fmin) & (freqs <= fmax)
-         freqs = freqs[mask]
+         for start in range(0, n_items, chunk_size):
+             stop = min(start + chunk_size, n_items)
+             data = _read_chunk(inst, is_epochs, start, stop)
 
-         if data.ndim == 2:
-             psd = psd[:, mask]
-         else:
-             psd = psd[:, :, mask]
+             fft_vals = sp_fft.rfft(data.astype(dtype, copy=False), axis=-1, workers=n_workers)
+             # Keep the requested slice only
+             fft_vals = fft_vals[..., bins]
+             psd[start:stop] = (fft_vals.real**2 + fft_vals.imag**2) * scale
 
          return freqs, psd
 
     else:
          raise NotImplementedError("This function requires a newer version of MNE-Python.")
+
+@lru_cache(maxsize=32)
+def _dpss_tapers(n_times, half_nbw, low_bias=True):
+    """
+    DPSS tapers and eigenvalues, cached on (n_times, half_nbw, low_bias).
+
+    The arrays are shared through the cache, do not modify them in place.
+    """
+    return mne.time_frequency.dpss_windows(n_times, half_nbw, int(2 * half_nbw),
+                                           sym=False, low_bias=low_bias)
+
+def _adaptive_weights_psd(power, eigvals, var, max_iter=250):
+    """
+    Adaptive multitaper PSD (Thomson), iterated for all signals at once.
+
+    Parameters:
+    -----------
+    power : array, shape (n_signals, n_tapers, n_freqs)
+        |tapered spectra|^2.
+    eigvals : array, shape (n_tapers,)
+    var : array, shape (n_signals,)
+        Variance of each signal, from the fixed-weight estimate.
+
+    Returns:
+    --------
+    psd : array, shape (n_signals, n_freqs)
+    """
+    eig = eigvals[np.newaxis, :, np.newaxis]
+    rt_eig = np.sqrt(eig)
+
+    def combine(weights_sq, pw):
+        return 2 * np.sum(weights_sq * pw, axis=1) / np.sum(weights_sq, axis=1)
+
+    # Start from the first two tapers
+    psd = combine(eig[:, :2], power[:, :2])
+    out = psd.copy()
+
+    # Working arrays only hold the signals that have not converged yet
+    idx = np.arange(len(power))
+    err = np.zeros_like(power)
+
+    for _ in range(max_iter):
+        p = psd[:, np.newaxis, :]
+        d_k = rt_eig * p / (eig * p + (1 - eig) * var[:, np.newaxis, np.newaxis])
+
+        # Converged when the mean squared weight change is below 1e-10 at every freq
+        err -= d_k
+        converged = np.max(np.mean(err**2, axis=1), axis=1) < 1e-10
+        if converged.any():
+            out[idx[converged]] = psd[converged]
+            keep = ~converged
+            idx, power, var, d_k = idx[keep], power[keep], var[keep], d_k[keep]
+            if len(idx) == 0:
+                break
+
+        psd = combine(d_k**2, power)
+        err = d_k
+    else:
+        out[idx] = psd
+        warnings.warn(f"Iterative multi-taper PSD computation did not converge for "
+                      f"{len(idx)} signal(s).", RuntimeWarning)
+
+    return out
+
+def compute_psd_multitaper(inst, fmin=0, fmax=np.inf, bandwidth=None, adaptive=False,
+                           low_bias=True, normalization='length', chunk_size=None,
+                           n_workers=None, max_iter=250):
+    """
+    Compute Power Spectral Density (PSD) using the multitaper method.
+
+    Equivalent to MNE's compute_psd(method='multitaper'), but the DPSS tapers
+    are cached across calls with the same (n_times, bandwidth), and all
+    tapers x channels x epochs of a chunk go through one batched FFT. Epochs
+    (or Raw channels) are read in chunks, and adaptive weights are iterated
+    for all signals of a chunk together.
+
+    Parameters:
+    -----------
+    inst : mne.io.Raw, mne.Epochs
+        The data object.
+    fmin : float
+        Lower frequency.
+    fmax : float
+        Upper frequency.
+    bandwidth : float | None
+        Full frequency bandwidth of the tapers in Hz. None uses a normalized
+        half-bandwidth of 4 (as MNE).
+    adaptive : bool
+        Use adaptive weights to combine the tapered spectra.
+    low_bias : bool
+        Only use tapers with more than 90% spectral concentration.
+    normalization : 'length' | 'full'
+        'full' additionally divides by the sampling frequency.
+    chunk_size : int | None
+        Number of epochs (Epochs) or channels (Raw) per batched FFT. None picks
+        a chunk of about 50 MB of tapered spectra.
+    n_workers : int | None
+        Number of threads for scipy.fft (-1 uses all cores).
+    max_iter : int
+        Maximum number of iterations of the adaptive weighting.
+
+    Returns:
+    --------
+    freqs : array
+        Frequencies.
+    psd : array
+        Power spectral density, (n_channels, n_freqs) or
+        (n_epochs, n_channels, n_freqs).
+    """
+    sfreq = inst.info['sfreq']
+    is_epochs, n_items, n_channels, n_times = _chunk_layout(inst)
+
+    if bandwidth is not None:
+        half_nbw = float(bandwidth) * n_times / (2.0 * sfreq)
+    else:
+        half_nbw = 4.0
+    if half_nbw < 0.5:
+        raise ValueError(f"bandwidth value {bandwidth} yields a normalized half-bandwidth of "
+                         f"{half_nbw} < 0.5, use a value of at least {sfreq / n_times}")
+
+    dpss, eigvals = _dpss_tapers(n_times, half_nbw, low_bias)
+    n_tapers = len(eigvals)
+    if adaptive and n_tapers < 3:
+        warnings.warn(f"Not adaptively combining the spectral estimators due to a "
+                      f"low number of tapers ({n_tapers} < 3).", RuntimeWarning)
+        adaptive = False
+
+    freqs = sp_fft.rfftfreq(n_times, 1.0 / sfreq)
+    mask = (freqs >= fmin) & (freqs <= fmax)
+    freqs = freqs[mask]
+
+    n_per_item = n_channels if is_epochs else 1
+    if chunk_size is None:
+        n_bins = n_times // 2 + 1
+        chunk_size = max(50000000 // (n_per_item * n_tapers * n_bins * 16), 1)
+
+    if is_epochs:
+        psd = np.empty((n_items, n_channels, len(freqs)))
+    else:
+        psd = np.empty((n_items, len(freqs)))
+
+    for start in range(0, n_items, chunk_size):
+        stop = min(start + chunk_size, n_items)
+        data = _read_chunk(inst, is_epochs, start, stop)
+        data = data - data.mean(axis=-1, keepdims=True)
+        shape = data.shape[:-1]
+
+        # All tapers x signals in one FFT: (n_signals, n_tapers, n_freqs)
+        data = data.reshape(-1, n_times)
+        x_mt = sp_fft.rfft(data[:, np.newaxis, :] * dpss, axis=-1, workers=n_workers)
+        power = x_mt.real**2 + x_mt.imag**2
+        del x_mt
+        # One-sided transform: DC and Nyquist are not doubled
+        power[..., 0] /= 2
+        if n_times % 2 == 0:
+            power[..., -1] /= 2
+
+        if adaptive:
+            # Signal variance from the fixed-weight estimate over all freqs
+            psd_est = 2 * np.tensordot(eigvals, power, axes=([0], [1])) / eigvals.sum()
+            var = trapezoid(psd_est, dx=np.pi / psd_est.shape[-1], axis=-1) / (2 * np.pi)
+            chunk_psd = _adaptive_weights_psd(power[..., mask], eigvals, var, max_iter=max_iter)
+        else:
+            chunk_psd = 2 * np.tensordot(eigvals, power[..., mask], axes=([0], [1])) / eigvals.sum()
+
+        psd[start:stop] = chunk_psd.reshape(shape + (len(freqs),))
+
+    if normalization == 'full':
+        psd /= sfreq
+
+    return freqs, psd
+
+class BandPowerTracker:
+    """
+    Incremental per-channel band power for live streams.
+
+    Samples are pushed in chunks into a ring buffer. Every `update_interval`
+    seconds one FFT is computed on the most recent `window_size` seconds
+    (overlapping frames), and the PSD is the running mean of the last
+    `n_average` frame periodograms (the new frame replaces the oldest in a
+    ring of frames), or an exponential average if `alpha` is given.
+    Each update therefore costs a single FFT, not a full Welch recomputation.
+
+    Parameters:
+    -----------
+    sfreq : float
+        Sampling frequency of the stream.
+    n_channels : int
+        Number of channels.
+    bands : dict
+        Band name -> (fmin, fmax), e.g. {'alpha': (8, 12)}.
+    window_size : float
+        FFT window length in seconds.
+    update_interval : float
+        Time between updates in seconds (hop between frames).
+    n_average : int
+        Number of frames in the running mean.
+    alpha : float | None
+        If given, use an exponential average psd = alpha * new + (1 - alpha) * psd
+        instead of the running mean.
+    window : str
+        Taper applied to each frame.
+    n_latencies : int
+        Number of recent push() latencies kept for latency_stats().
+    """
+
+    def __init__(self, sfreq, n_channels, bands, window_size=1.0, update_interval=0.05,
+                 n_average=4, alpha=None, window='hann', n_latencies=10000):
+        self.sfreq = float(sfreq)
+        self.n_channels = int(n_channels)
+        self.band_names = list(bands)
+        self.n_window = int(round(window_size * sfreq))
+        self.hop = max(1, int(round(update_interval * sfreq)))
+        self.n_average = int(n_average)
+        self.alpha = alpha
+
+        self.win = signal.get_window(window, self.n_window)
+        self.freqs = np.fft.rfftfreq(self.n_window, 1.0 / self.sfreq)
+
+        # Density scaling, one-sided
+        scale = np.full(len(self.freqs), 2.0 / (self.sfreq * np.sum(self.win**2)))
+        scale[0] /= 2
+        if self.n_window % 2 == 0:
+            scale[-1] /= 2
+        self._scale = scale
+
+        # Band integration matrix: band_power = psd @ band_matrix
+        df = self.freqs[1] - self.freqs[0] if len(self.freqs) > 1 else 1.0
+        self._band_matrix = np.zeros((len(self.freqs), len(self.band_names)))
+        for i, name in enumerate(self.band_names):
+            fmin, fmax = bands[name]
+            self._band_matrix[(self.freqs >= fmin) & (self.freqs <= fmax), i] = df
+
+        self.latencies = deque(maxlen=n_latencies)
+        self.reset()
+
+    def reset(self):
+        """Clear the buffer and the PSD estimate."""
+        # Double-length ring buffer: every sample is written twice, so the
+        # latest window is always a contiguous slice
+        self._buffer = np.zeros((self.n_channels, 2 * self.n_window))
+        self._pos = 0
+        self._n_seen = 0
+        self._since_update = 0
+
+        self._frames = np.zeros((self.n_average, self.n_channels, len(self.freqs)))
+        self._frame_idx = 0
+        self._n_frames = 0
+        self.psd = None
+        self.band_power = None
+        self.latencies.clear()
+
+    def _write(self, chunk):
+        n = chunk.shape[1]
+        idx = (self._pos + np.arange(n)) % self.n_window
+        self._buffer[:, idx] = chunk
+        self._buffer[:, idx + self.n_window] = chunk
+        self._pos = (self._pos + n) % self.n_window
+        self._n_seen += n
+
+    def _update(self):
+        frame = self._buffer[:, self._pos:self._pos + self.n_window]
+        frame = (frame - frame.mean(axis=1, keepdims=True)) * self.win
+        spec = sp_fft.rfft(frame, axis=-1)
+        periodogram = (spec.real**2 + spec.imag**2) * self._scale
+
+        if self.alpha is not None:
+            if self.psd is None:
+                self.psd = periodogram
+            else:
+                self.psd = self.alpha * periodogram + (1 - self.alpha) * self.psd
+        else:
+            # Running mean: the new frame replaces the oldest. Summing the
+            # n_average frames (instead of adding and subtracting into a
+            # running sum) keeps rounding errors from accumulating.
+            self._frames[self._frame_idx] = periodogram
+            self._frame_idx = (self._frame_idx + 1) % self.n_average
+            self._n_frames = min(self._n_frames + 1, self.n_average)
+            self.psd = self._frames.sum(axis=0) / self._n_frames
+
+        self.band_power = self.psd @ self._band_matrix
+        return self.band_power
+
+    def push(self, chunk):
+        """
+        Ingest a chunk of samples.
+
+        Parameters:
+        -----------
+        chunk : array, shape (n_channels, n_samples)
+
+        Returns:
+        --------
+        updates : array, shape (n_updates, n_channels, n_bands)
+            Band power after every update triggered by this chunk (empty if
+            the chunk did not complete an update interval, or the buffer is
+            not full yet).
+        """
+        t0 = time.perf_counter()
+        chunk = np.asarray(chunk, dtype=float)
+        if chunk.shape[0] != self.n_channels:
+            raise ValueError(f"Expected {self.n_channels} channels, got {chunk.shape[0]}")
+
+        updates = []
+        start = 0
+        n_samples = chunk.shape[1]
+        while start < n_samples:
+            # Write up to the next update boundary
+            n = min(self.hop - self._since_update, n_samples - start)
+            self._write(chunk[:, start:start + n])
+            self._since_update += n
+            start += n
+
+            if self._since_update == self.hop:
+                self._since_update = 0
+                if self._n_seen >= self.n_window:
+                    updates.append(self._update().copy())
+
+        self.latencies.append(time.perf_counter() - t0)
+
+        if updates:
+            return np.stack(updates)
+        return np.zeros((0, self.n_channels, len(self.band_names)))
+
+    def latency_stats(self):
+        """
+        Percentiles of push() processing time, in milliseconds.
+
+        Returns:
+        --------
+        stats : dict
+            'n', 'mean', 'p50', 'p95', 'p99' and 'max'.
+        """
+        lat = np.array(self.latencies) * 1000.0
+        if len(lat) == 0:
+            return {'n': 0}
+        return {
+            'n': len(lat),
+            'mean': lat.mean(),
+            'p50': np.percentile(lat, 50),
+            'p95': np.percentile(lat, 95),
+            'p99': np.percentile(lat, 99),
+            'max': lat.max(),
+        }
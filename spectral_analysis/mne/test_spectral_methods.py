@@ -0,0 +1,45 @@
+import numpy as np
+import mne
+import pytest
+from spectral_methods import compute_psd_fft, compute_psd_multitaper
+
+def create_rejected_epochs():
+    """Non-preloaded Epochs, two of which exceed the rejection threshold."""
+    rng = np.random.RandomState(0)
+    sfreq = 100.0
+    data = 1e-5 * rng.randn(5, 2000)
+    data[:, 1050] = 1e-3 # artifact inside the 10th and 11th epochs
+    info = mne.create_info([f'EEG{i}' for i in range(5)], sfreq, 'eeg')
+    raw = mne.io.RawArray(data, info, verbose=False)
+    events = mne.make_fixed_length_events(raw, duration=1.0)
+    return mne.Epochs(raw, events, tmin=0, tmax=2.0 - 1 / sfreq, baseline=None, preload=False,
+                      reject=dict(eeg=1e-4), verbose=False)
+
+def test_psd_fft_non_preloaded_rejected_epochs():
+    freqs, psd = compute_psd_fft(create_rejected_epochs(), 1, 40, chunk_size=4)
+
+    # Same as the unchunked computation on the preloaded, cleaned epochs
+    epochs = create_rejected_epochs().load_data()
+    freqs_ref, psd_ref = compute_psd_fft(epochs, 1, 40)
+    assert psd.shape == psd_ref.shape == (len(epochs), 5, len(freqs_ref))
+    assert len(epochs) < len(epochs.drop_log) # some epochs were rejected
+    np.testing.assert_allclose(freqs, freqs_ref)
+    np.testing.assert_allclose(psd, psd_ref)
+
+def test_psd_multitaper_non_preloaded_rejected_epochs():
+    freqs, psd = compute_psd_multitaper(create_rejected_epochs(), 1, 40, adaptive=True,
+                                        chunk_size=4)
+
+    epochs = create_rejected_epochs().load_data()
+    freqs_ref, psd_ref = compute_psd_multitaper(epochs, 1, 40, adaptive=True)
+    assert psd.shape == psd_ref.shape == (len(epochs), 5, len(freqs_ref))
+    np.testing.assert_allclose(freqs, freqs_ref)
+    np.testing.assert_allclose(psd, psd_ref)
+
+def test_psd_multitaper_adaptive_warnings():
+    epochs = create_rejected_epochs().load_data()
+    with pytest.warns(RuntimeWarning, match='did not converge'):
+        compute_psd_multitaper(epochs, 1, 40, adaptive=True, max_iter=1)
+    # bandwidth 1 Hz on 2 s epochs gives 2 tapers
+    with pytest.warns(RuntimeWarning, match='low number of tapers'):
+        compute_psd_multitaper(epochs, 1, 40, bandwidth=1.0, adaptive=True)